@@ -0,0 +1,107 @@
+import json
+import uuid
+from datetime import datetime, timedelta, timezone
+
+EPOCH = datetime(2022, 5, 30, 20, 0, tzinfo=timezone.utc)
+TOPIC_ARN = "arn:aws:sns:us-east-2:133534076130:turbot_firehose_raw_alarms"
+QUEUE_ARN = "arn:aws:sqs:us-east-2:133534076130:turbot_firehose_raw_alarms_queue"
+
+def format_timestamp(moment: datetime) -> str:
+  return moment.strftime("%Y-%m-%dT%H:%M:%S.") + f"{moment.microsecond // 1000:03d}Z"
+
+def build_notification(control_id: str, state: str, old_state: str, old_version_id: int, new_version_id: int,
+                       account_id: str = "133534076130", region_name: str = "us-east-2",
+                       control_type: str = "AWS > S3 > Bucket > Encryption at Rest",
+                       reason: str = "Default Encryption at Rest is not set as per policy",
+                       created: datetime = EPOCH, details: list = None) -> dict:
+  """A Turbot control_updated notification shaped like the samples in functions/test.py."""
+  return {
+    "notificationType": "control_updated",
+    "actor": {
+      "alternatePersona": None,
+      "identity": {
+        "title": "Turbot Identity",
+        "picture": "https://www.gravatar.com/avatar/cb9ff8606c24daf9cda1d82615bd7a8e",
+        "turbot": {"title": "Turbot Identity", "id": "165643662385311"}
+      }
+    },
+    "turbot": {
+      "type": None,
+      "controlId": control_id,
+      "controlOldVersionId": str(old_version_id),
+      "controlNewVersionId": str(new_version_id),
+      "createTimestamp": format_timestamp(created)
+    },
+    "control": {
+      "state": state,
+      "reason": reason,
+      "details": details,
+      "type": {"trunk": {"title": control_type}},
+      "turbot": {"id": control_id},
+      "resource": {
+        "title": None,
+        "metadata": {
+          "aws": {"accountId": account_id, "partition": "aws", "regionName": region_name},
+          "createTimestamp": format_timestamp(created - timedelta(days=30))
+        },
+        "turbot": {"title": f"bucket-{control_id}", "tags": {}, "id": f"9{control_id}"}
+      }
+    },
+    "oldControl": {
+      "state": old_state,
+      "turbot": {"id": control_id}
+    }
+  }
+
+def build_sqs_record(notification: dict, published: datetime = EPOCH) -> dict:
+  """Wrap a notification the way SNS delivers it to the raw alarms queue."""
+  sent = int(published.timestamp() * 1000)
+  envelope = {
+    "Type": "Notification",
+    "MessageId": str(uuid.uuid4()),
+    "TopicArn": TOPIC_ARN,
+    "Subject": f"[turbot] Control {notification['control']['type']['trunk']['title'].split(' > ')[-1]} updated by Turbot Identity",
+    "Message": json.dumps(notification, separators=(',', ':')),
+    "Timestamp": format_timestamp(published),
+    "SignatureVersion": "1",
+    "Signature": "EXAMPLE",
+    "SigningCertURL": "https://sns.us-east-2.amazonaws.com/SimpleNotificationService-EXAMPLE.pem",
+    "UnsubscribeURL": f"https://sns.us-east-2.amazonaws.com/?Action=Unsubscribe&SubscriptionArn={TOPIC_ARN}:EXAMPLE"
+  }
+  return {
+    "messageId": str(uuid.uuid4()),
+    "receiptHandle": "EXAMPLE",
+    "body": json.dumps(envelope, indent=2),
+    "attributes": {
+      "ApproximateReceiveCount": "1",
+      "SentTimestamp": str(sent),
+      "SenderId": "AIDAIVEA3AGEU7NF6DRAG",
+      "ApproximateFirstReceiveTimestamp": str(sent + 1)
+    },
+    "messageAttributes": {},
+    "md5OfMessageAttributes": None,
+    "md5OfBody": "EXAMPLE",
+    "eventSource": "aws:sqs",
+    "eventSourceARN": QUEUE_ARN,
+    "awsRegion": "us-east-2"
+  }
+
+def build_findings_record(entry: dict, sent: int) -> dict:
+  """Turn a SendMessageBatch entry from the filter into a findings queue Lambda record."""
+  return {
+    "messageId": str(uuid.uuid4()),
+    "receiptHandle": "EXAMPLE",
+    "body": entry['MessageBody'],
+    "attributes": {
+      "ApproximateReceiveCount": "1",
+      "SentTimestamp": str(sent),
+      "ApproximateFirstReceiveTimestamp": str(sent + 1)
+    },
+    "messageAttributes": {
+      name: {"stringValue": value['StringValue'], "dataType": value['DataType']}
+      for name, value in entry.get('MessageAttributes', {}).items()
+    },
+    "eventSource": "aws:sqs",
+    "eventSourceARN": QUEUE_ARN.replace("raw_alarms", "findings"),
+    "awsRegion": "us-east-2"
+  }
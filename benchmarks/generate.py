@@ -0,0 +1,125 @@
+import sys
+import json
+import random
+import argparse
+from datetime import timedelta
+from events import EPOCH, build_notification, build_sqs_record
+
+CONTROL_TYPES = [
+  "AWS > S3 > Bucket > Encryption at Rest",
+  "AWS > S3 > Bucket > Approved",
+  "AWS > EC2 > Instance > Approved",
+  "AWS > VPC > Security Group > Ingress Rules > Approved",
+  "AWS > IAM > Role > Approved",
+  "AWS > RDS > DB Instance > Encryption at Rest"
+]
+DEFAULT_TRANSITIONS = "ok:alarm=0.4,alarm:ok=0.3,alarm:alarm=0.1,ok:ok=0.05,ok:error=0.05,error:alarm=0.05,tbd:alarm=0.05"
+
+def parse_weights(spec: str) -> list:
+  """Parse "old:new=weight,..." into [((old, new), weight), ...]."""
+  weights = []
+  for item in spec.split(","):
+    transition, weight = item.split("=")
+    old_state, state = transition.split(":")
+    weights.append(((old_state, state), float(weight)))
+  return weights
+
+class NotificationGenerator:
+  """
+  Synthetic SQS-wrapped SNS control_updated notifications.
+
+  Controls are spread over the given accounts and regions and each keeps
+  its own increasing version id. A share of messages are redelivered
+  duplicates, moved a few places out of order, or notification types the
+  filter drops straight away.
+  """
+  def __init__(self, controls: int = 1000, accounts: int = 20, regions: list = None,
+               transitions: str = DEFAULT_TRANSITIONS, duplicate_rate: float = 0.0,
+               out_of_order_rate: float = 0.0, other_type_rate: float = 0.0, details: int = 0,
+               rate: float = 100.0, seed: int = None) -> None:
+    self.__random = random.Random(seed)
+    regions = regions or ["us-east-1", "us-east-2", "eu-west-1"]
+    account_ids = [str(100000000000 + index) for index in range(accounts)]
+    self.__controls = [{
+      "id": str(250000000000000 + index),
+      "account": self.__random.choice(account_ids),
+      "region": self.__random.choice(regions),
+      "type": self.__random.choice(CONTROL_TYPES),
+      "version": 300000000000000 + index * 1000
+    } for index in range(controls)]
+    transitions = parse_weights(transitions)
+    self.__transitions = [transition for transition, _ in transitions]
+    self.__weights = [weight for _, weight in transitions]
+    self.__duplicate_rate = duplicate_rate
+    self.__out_of_order_rate = out_of_order_rate
+    self.__other_type_rate = other_type_rate
+    self.__details = [
+      {"key": f"Check {index}", "value": "Not approved" if index % 2 else "Approved"} for index in range(details)
+    ] or None
+    self.__interval = timedelta(seconds=1 / rate) if rate > 0 else timedelta(0)
+    self.__created = EPOCH
+
+  def build_notification(self) -> dict:
+    control = self.__random.choice(self.__controls)
+    old_state, state = self.__random.choices(self.__transitions, self.__weights)[0]
+    control["version"] += 1
+    self.__created += self.__interval
+    notification = build_notification(
+      control["id"], state, old_state, control["version"] - 1, control["version"],
+      account_id=control["account"], region_name=control["region"], control_type=control["type"],
+      reason="Approved" if state == "ok" else "Not approved", created=self.__created,
+      details=self.__details
+    )
+    if self.__random.random() < self.__other_type_rate:
+      notification["notificationType"] = "resource_updated"
+    return notification
+
+  def generate(self, count: int) -> list:
+    records = []
+    while len(records) < count:
+      if records and self.__random.random() < self.__duplicate_rate:
+        # SNS redelivery: same notification, new SQS message
+        duplicate = dict(records[self.__random.randrange(max(0, len(records) - 10), len(records))])
+        duplicate["messageId"] = f"{duplicate['messageId'][:-12]}{self.__random.getrandbits(48):012x}"
+        records.append(duplicate)
+        continue
+      notification = self.build_notification()
+      records.append(build_sqs_record(notification, self.__created + timedelta(seconds=5)))
+    for index in range(1, len(records)):
+      if self.__random.random() < self.__out_of_order_rate:
+        other = self.__random.randrange(max(0, index - 5), index)
+        records[index], records[other] = records[other], records[index]
+    return records
+
+def main() -> None:
+  parser = argparse.ArgumentParser(description="Write synthetic raw alarm queue records as JSONL")
+  parser.add_argument("--count", type=int, default=1000, help="records to generate")
+  parser.add_argument("--controls", type=int, default=1000, help="distinct controls")
+  parser.add_argument("--accounts", type=int, default=20, help="distinct AWS accounts")
+  parser.add_argument("--regions", default="us-east-1,us-east-2,eu-west-1", help="comma separated regions")
+  parser.add_argument("--transitions", default=DEFAULT_TRANSITIONS, help="old:new=weight,... state transition mix")
+  parser.add_argument("--duplicate-rate", type=float, default=0.05, help="share of redelivered records")
+  parser.add_argument("--out-of-order-rate", type=float, default=0.05, help="share of records moved out of order")
+  parser.add_argument("--other-type-rate", type=float, default=0.1, help="share of non control_updated notifications")
+  parser.add_argument("--details", type=int, default=0, help="control detail rows per notification, for payload size")
+  parser.add_argument("--rate", type=float, default=100.0, help="simulated notifications per second for timestamps")
+  parser.add_argument("--seed", type=int)
+  parser.add_argument("--output", help="JSONL file to write, stdout when omitted")
+  args = parser.parse_args()
+
+  generator = NotificationGenerator(
+    controls=args.controls, accounts=args.accounts, regions=args.regions.split(","),
+    transitions=args.transitions, duplicate_rate=args.duplicate_rate,
+    out_of_order_rate=args.out_of_order_rate, other_type_rate=args.other_type_rate,
+    details=args.details, rate=args.rate, seed=args.seed
+  )
+  output = open(args.output, "w") if args.output else sys.stdout
+  try:
+    for record in generator.generate(args.count):
+      output.write(json.dumps(record) + "\n")
+  finally:
+    if output is not sys.stdout:
+      output.close()
+
+if __name__ == "__main__":
+  main()
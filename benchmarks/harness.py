@@ -0,0 +1,48 @@
+import os
+import sys
+import resource
+
+# Handler configuration is read at import time; keep the run quiet and let a
+# partially failed batch report its failures instead of raising
+os.environ.setdefault('AWS_REGION', 'us-east-2')
+os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-2')
+os.environ.setdefault('WORKSPACE_NAME', 'benchmark')
+os.environ.setdefault('FINDINGS_QUEUE_URL', 'https://sqs.us-east-2.amazonaws.com/133534076130/findings')
+os.environ.setdefault('REPORT_BATCH_ITEM_FAILURES', 'true')
+os.environ.setdefault('LOG_LEVEL', 'CRITICAL')
+os.environ.setdefault('METRICS_ENABLED', 'false')
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "functions"))
+from stubs import GraphQlStub, FakeAws
+
+def percentile(values: list, fraction: float) -> float:
+  ordered = sorted(values)
+  return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+def get_peak_rss_mb() -> float:
+  """Peak resident set size of the whole process so far; it never goes down."""
+  # ru_maxrss is in kilobytes on Linux and bytes on macOS
+  peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+  return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+def add_stub_arguments(parser) -> None:
+  parser.add_argument("--graphql-latency-ms", type=float, default=50.0)
+  parser.add_argument("--graphql-error-rate", type=float, default=0.0)
+  parser.add_argument("--aws-latency-ms", type=float, default=5.0)
+
+def start_stubs(args):
+  """Start the GraphQL stub and install the AWS fakes with the SSM parameters both handlers read."""
+  stub = GraphQlStub(args.graphql_latency_ms / 1000, args.graphql_error_rate).start()
+  workspace_path = f"/sechub/integration/{os.environ['WORKSPACE_NAME']}/"
+  aws = FakeAws({
+    f"{workspace_path}workspace/url": stub.get_url(),
+    f"{workspace_path}workspace/access_key": "access",
+    f"{workspace_path}workspace/secret_key": "secret",
+    "/sechub/integration/siemens/role/name": "turbot_securityhub_reporting",
+    "/sechub/integration/siemens/role/externalid": "external"
+  }, args.aws_latency_ms / 1000).install()
+  return stub, aws
+
+def stop_stubs(stub, aws) -> None:
+  aws.uninstall()
+  stub.stop()
@@ -0,0 +1,114 @@
+import json
+import time
+import argparse
+from harness import add_stub_arguments, start_stubs, stop_stubs, percentile
+from events import build_findings_record
+
+import filter_function
+import sechub_function
+from notification_parser import parse_record
+
+def read_batches(path: str, batch_size: int) -> list:
+  """
+  Lambda events from a JSONL capture. A line is either a single SQS record,
+  grouped into batches of batch_size, or a whole {"Records": [...]} event as
+  received by the handler, which is replayed unchanged.
+  """
+  batches = []
+  pending = []
+  with open(path) as capture:
+    for line in capture:
+      if not line.strip():
+        continue
+      item = json.loads(line)
+      if "Records" in item:
+        batches.append(item)
+        continue
+      pending.append(item)
+      if len(pending) == batch_size:
+        batches.append({"Records": pending})
+        pending = []
+  if pending:
+    batches.append({"Records": pending})
+  return batches
+
+def track_control_states(stub, event: dict, versions: dict) -> None:
+  """Point the GraphQL stub at the newest state seen for each control so far."""
+  for event_record in event["Records"]:
+    try:
+      record = parse_record(event_record)
+    except (ValueError, KeyError, TypeError):
+      continue
+    if record.control_id is None or not (record.new_version_id or "").isdigit():
+      continue
+    version = int(record.new_version_id)
+    if version > versions.get(record.control_id, 0):
+      versions[record.control_id] = version
+      stub.set_state(record.control_id, record.state)
+
+def invoke(stats: list, handler, event: dict) -> None:
+  start = time.perf_counter()
+  response = handler(event, None)
+  stats[0].append(time.perf_counter() - start)
+  stats[1] += len(event["Records"])
+  stats[2] += len(response.get("batchItemFailures", []))
+
+def summarize(name: str, latencies: list, records: int, failed: int) -> dict:
+  return {
+    "function": name,
+    "invocations": len(latencies),
+    "records": records,
+    "failed": failed,
+    "p50_ms": round(percentile(latencies, 0.50) * 1000, 3) if latencies else None,
+    "p99_ms": round(percentile(latencies, 0.99) * 1000, 3) if latencies else None
+  }
+
+def main() -> None:
+  parser = argparse.ArgumentParser(description="Replay a JSONL capture of raw alarm queue records into the handlers")
+  parser.add_argument("capture", help="JSONL file of SQS records or Lambda events")
+  parser.add_argument("--batch-size", type=int, default=10, help="records per invocation for single record lines")
+  parser.add_argument("--rate", type=float, default=0.0, help="target records per second, 0 for as fast as possible")
+  parser.add_argument("--sechub", action="store_true", help="also feed queued findings to the Security Hub handler")
+  add_stub_arguments(parser)
+  args = parser.parse_args()
+
+  batches = read_batches(args.capture, args.batch_size)
+  stub, aws = start_stubs(args)
+  versions = {}
+  # latencies, records and failed records per handler
+  stats = {"filter": [[], 0, 0], "sechub": [[], 0, 0]}
+  replayed = 0
+  started = time.monotonic()
+  try:
+    for event in batches:
+      if args.rate > 0:
+        delay = started + replayed / args.rate - time.monotonic()
+        if delay > 0:
+          time.sleep(delay)
+      track_control_states(stub, event, versions)
+      aws.sqs.drain()
+      invoke(stats["filter"], filter_function.lambda_handler, event)
+      queued = aws.sqs.drain()
+      if args.sechub and queued:
+        sent = int(time.time() * 1000)
+        findings = {"Records": [build_findings_record(entry, sent) for entry in queued]}
+        invoke(stats["sechub"], sechub_function.lambda_handler, findings)
+      replayed += len(event["Records"])
+  finally:
+    stop_stubs(stub, aws)
+  elapsed = time.monotonic() - started
+
+  report = {
+    "elapsed_sec": round(elapsed, 3),
+    "records_per_sec": round(replayed / elapsed, 1) if elapsed else None,
+    "functions": [summarize(name, *values) for name, values in stats.items() if values[0]],
+    "graphql_requests": stub.get_request_count(),
+    "sqs_calls": aws.sqs.calls,
+    "securityhub_calls": aws.securityhub.calls,
+    "findings_imported": aws.securityhub.imported,
+    "findings_resolved": aws.securityhub.resolved
+  }
+  print(json.dumps(report, indent=2))
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,154 @@
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import tempfile
+import subprocess
+from datetime import timedelta
+from harness import add_stub_arguments, start_stubs, stop_stubs, percentile, get_peak_rss_mb
+from events import EPOCH, build_notification, build_sqs_record, build_findings_record
+from stubs import GraphQlStub, FakeAws
+
+import filter_function
+import sechub_function
+
+class Workload:
+  """
+  Alarm notifications over a fixed pool of controls. Every batch moves its
+  controls to a new version so the filter's version cache never skips them.
+  """
+  def __init__(self, stub: GraphQlStub, controls: int, accounts: int, seed: int) -> None:
+    self.__stub = stub
+    self.__random = random.Random(seed)
+    self.__control_ids = [str(250000000000000 + index) for index in range(controls)]
+    self.__accounts = [str(100000000000 + index) for index in range(accounts)]
+    self.__version = 300000000000000
+    self.__sequence = 0
+
+  def build_batch(self, size: int) -> dict:
+    records = []
+    for _ in range(size):
+      control_id = self.__random.choice(self.__control_ids)
+      account_id = self.__accounts[int(control_id) % len(self.__accounts)]
+      self.__version += 2
+      self.__sequence += 1
+      created = EPOCH + timedelta(milliseconds=self.__sequence)
+      self.__stub.set_state(control_id, "alarm")
+      notification = build_notification(
+        control_id, "alarm", "ok", self.__version - 1, self.__version, account_id=account_id, created=created
+      )
+      records.append(build_sqs_record(notification, created + timedelta(seconds=5)))
+    return {"Records": records}
+
+def measure(name: str, handler, size: int, batches: list) -> dict:
+  latencies = []
+  failed = 0
+  for event in batches:
+    start = time.perf_counter()
+    response = handler(event, None)
+    latencies.append(time.perf_counter() - start)
+    failed += len(response.get("batchItemFailures", []))
+  records = sum(len(event["Records"]) for event in batches)
+  return {
+    "function": name,
+    "batch_size": size,
+    "invocations": len(batches),
+    "records_per_sec": round(records / sum(latencies), 1),
+    "p50_ms": round(percentile(latencies, 0.50) * 1000, 3),
+    "p99_ms": round(percentile(latencies, 0.99) * 1000, 3),
+    "failed": failed,
+    "peak_rss_mb": round(get_peak_rss_mb(), 1)
+  }
+
+def build_findings_batches(aws: FakeAws, workload: Workload, size: int, invocations: int) -> list:
+  """Run the filter untimed and feed what it queued to the Security Hub function."""
+  batches = []
+  for _ in range(invocations):
+    aws.sqs.drain()
+    filter_function.lambda_handler(workload.build_batch(size), None)
+    sent = int(time.time() * 1000)
+    batches.append({"Records": [build_findings_record(entry, sent) for entry in aws.sqs.drain()]})
+  return batches
+
+HANDLERS = {"filter": filter_function.lambda_handler, "sechub": sechub_function.lambda_handler}
+
+def measure_in_subprocess(args, name: str, size: int, batches: list) -> dict:
+  """
+  Time batches in a fresh interpreter. ru_maxrss is a peak over the life of
+  the process, so each (function, batch size) gets its own process and only
+  its own batches, not the workload generation or earlier runs.
+  """
+  with tempfile.NamedTemporaryFile("w", suffix=".json", delete=False) as batch_file:
+    json.dump(batches, batch_file)
+  try:
+    output = subprocess.run([
+      sys.executable, os.path.abspath(__file__), "--measure", name, "--measure-size", str(size),
+      "--measure-batches", batch_file.name,
+      "--graphql-latency-ms", str(args.graphql_latency_ms),
+      "--graphql-error-rate", str(args.graphql_error_rate),
+      "--aws-latency-ms", str(args.aws_latency_ms)
+    ], check=True, capture_output=True, text=True).stdout
+  finally:
+    os.unlink(batch_file.name)
+  return json.loads(output.strip().splitlines()[-1])
+
+def run_measure(args) -> None:
+  """Child side of measure_in_subprocess: time the batches and print the result as JSON."""
+  with open(args.measure_batches) as batch_file:
+    batches = json.load(batch_file)
+  stub, aws = start_stubs(args)
+  try:
+    result = measure(args.measure, HANDLERS[args.measure], args.measure_size, batches)
+  finally:
+    stop_stubs(stub, aws)
+  print(json.dumps(result))
+
+def main() -> None:
+  parser = argparse.ArgumentParser(
+    description="Run the filter and Security Hub handlers against a local GraphQL stub and in-memory AWS fakes"
+  )
+  parser.add_argument("--batch-sizes", default="1,10,100,1000", help="comma separated records per invocation")
+  parser.add_argument("--invocations", type=int, default=20, help="invocations per batch size")
+  parser.add_argument("--functions", default="filter,sechub", help="comma separated: filter, sechub")
+  parser.add_argument("--controls", type=int, default=10000, help="distinct controls in the workload")
+  parser.add_argument("--accounts", type=int, default=20, help="distinct AWS accounts in the workload")
+  add_stub_arguments(parser)
+  parser.add_argument("--seed", type=int, default=42)
+  parser.add_argument("--output", help="also write the results as JSON to this file")
+  # Internal: measure one function over pre-built batches, see measure_in_subprocess
+  parser.add_argument("--measure", choices=sorted(HANDLERS), help=argparse.SUPPRESS)
+  parser.add_argument("--measure-size", type=int, help=argparse.SUPPRESS)
+  parser.add_argument("--measure-batches", help=argparse.SUPPRESS)
+  args = parser.parse_args()
+  if args.measure:
+    run_measure(args)
+    return
+
+  stub, aws = start_stubs(args)
+  workload = Workload(stub, args.controls, args.accounts, args.seed)
+  functions = args.functions.split(",")
+
+  results = []
+  try:
+    for size in [int(size) for size in args.batch_sizes.split(",")]:
+      if "filter" in functions:
+        batches = [workload.build_batch(size) for _ in range(args.invocations)]
+        results.append(measure_in_subprocess(args, "filter", size, batches))
+      if "sechub" in functions:
+        batches = build_findings_batches(aws, workload, size, args.invocations)
+        results.append(measure_in_subprocess(args, "sechub", size, batches))
+  finally:
+    stop_stubs(stub, aws)
+
+  columns = list(results[0].keys()) if results else []
+  print("  ".join(f"{column:>15}" for column in columns))
+  for result in results:
+    print("  ".join(f"{str(result[column]):>15}" for column in columns))
+  if args.output:
+    with open(args.output, "w") as output:
+      json.dump(results, output, indent=2)
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,215 @@
+import json
+import time
+import random
+import threading
+import boto3
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+class GraphQlStub:
+  """
+  Local stand-in for the Turbot GraphQL endpoint. Answers the aliased
+  control lookups sent by filter_function with the state registered for
+  each control id, after a configurable delay, and fails a configurable
+  share of requests with HTTP 500.
+  """
+  def __init__(self, latency: float = 0.0, error_rate: float = 0.0, default_state: str = "alarm") -> None:
+    self.latency = latency
+    self.error_rate = error_rate
+    self.default_state = default_state
+    self.__states = {}
+    self.__requests = 0
+    self.__lock = threading.Lock()
+    self.__server = ThreadingHTTPServer(("127.0.0.1", 0), self.__build_handler())
+    self.__server.daemon_threads = True
+    self.__thread = threading.Thread(target=self.__server.serve_forever, daemon=True)
+
+  def __build_handler(self):
+    stub = self
+
+    class Handler(BaseHTTPRequestHandler):
+      # Keep-alive, so the pooled requests session in the filter is exercised
+      protocol_version = "HTTP/1.1"
+      # Headers and body are separate writes; avoid Nagle/delayed ACK stalls
+      disable_nagle_algorithm = True
+
+      def do_POST(self):
+        payload = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))))
+        status, body = stub.answer(payload)
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+      def log_message(self, format, *args):
+        pass
+
+    return Handler
+
+  def start(self) -> "GraphQlStub":
+    self.__thread.start()
+    return self
+
+  def stop(self) -> None:
+    self.__server.shutdown()
+    self.__server.server_close()
+
+  def get_url(self) -> str:
+    host, port = self.__server.server_address
+    return f"http://{host}:{port}/"
+
+  def set_state(self, control_id: str, state: str) -> None:
+    with self.__lock:
+      self.__states[control_id] = state
+
+  def get_request_count(self) -> int:
+    with self.__lock:
+      return self.__requests
+
+  def answer(self, payload: dict):
+    with self.__lock:
+      self.__requests += 1
+    if self.latency:
+      time.sleep(self.latency)
+    if self.error_rate and random.random() < self.error_rate:
+      return 500, {"errors": [{"message": "Internal server error"}]}
+    data = {}
+    for alias, control_id in (payload.get('variables') or {}).items():
+      with self.__lock:
+        state = self.__states.get(control_id, self.default_state)
+      if state is None:
+        data[alias] = None
+        continue
+      data[alias] = {"state": state, "resource": {"akas": [f"arn:aws:s3:::bucket-{control_id}"]}}
+    return 200, {"data": data}
+
+class FakeClient:
+  """Base for the in-memory boto3 fakes: counts calls and adds a per-call delay."""
+  def __init__(self, latency: float = 0.0) -> None:
+    self.latency = latency
+    self.calls = {}
+    self._lock = threading.Lock()
+
+  def _call(self, operation: str) -> None:
+    with self._lock:
+      self.calls[operation] = self.calls.get(operation, 0) + 1
+    if self.latency:
+      time.sleep(self.latency)
+
+  def close(self) -> None:
+    pass
+
+class FakePaginator:
+  def __init__(self, pages: list) -> None:
+    self.__pages = pages
+
+  def paginate(self, **kwargs):
+    return iter(self.__pages)
+
+class FakeSsm(FakeClient):
+  def __init__(self, parameters: dict, latency: float = 0.0) -> None:
+    super().__init__(latency)
+    self.parameters = parameters
+
+  def get_paginator(self, operation: str) -> FakePaginator:
+    if operation != 'get_parameters_by_path':
+      raise ValueError(f"{operation} is not supported by FakeSsm")
+    self._call(operation)
+    return FakePaginator([{
+      'Parameters': [{'Name': name, 'Value': value} for name, value in self.parameters.items()]
+    }])
+
+class FakeSqs(FakeClient):
+  def __init__(self, latency: float = 0.0) -> None:
+    super().__init__(latency)
+    self.messages = []
+
+  def send_message_batch(self, QueueUrl, Entries, **kwargs):
+    self._call('send_message_batch')
+    with self._lock:
+      self.messages.extend(Entries)
+    return {'Successful': [{'Id': entry['Id']} for entry in Entries], 'Failed': []}
+
+  def send_message(self, QueueUrl, MessageBody, **kwargs):
+    self._call('send_message')
+    with self._lock:
+      self.messages.append(dict(kwargs, MessageBody=MessageBody))
+    return {}
+
+  def change_message_visibility(self, QueueUrl, ReceiptHandle, VisibilityTimeout, **kwargs):
+    self._call('change_message_visibility')
+    return {}
+
+  def change_message_visibility_batch(self, QueueUrl, Entries, **kwargs):
+    self._call('change_message_visibility_batch')
+    return {'Successful': [{'Id': entry['Id']} for entry in Entries], 'Failed': []}
+
+  def drain(self) -> list:
+    with self._lock:
+      messages, self.messages = self.messages, []
+    return messages
+
+class FakeSts(FakeClient):
+  def __init__(self, latency: float = 0.0, duration: int = 3600) -> None:
+    super().__init__(latency)
+    self.duration = duration
+
+  def assume_role(self, RoleArn, RoleSessionName, **kwargs):
+    self._call('assume_role')
+    return {
+      'Credentials': {
+        'AccessKeyId': 'ASIAEXAMPLE',
+        'SecretAccessKey': 'secret',
+        'SessionToken': f"token-{RoleArn}-{time.monotonic()}",
+        'Expiration': datetime.now(timezone.utc) + timedelta(seconds=self.duration)
+      },
+      'AssumedRoleUser': {'AssumedRoleId': 'AROAEXAMPLE', 'Arn': RoleArn}
+    }
+
+class FakeSecurityHub(FakeClient):
+  def __init__(self, latency: float = 0.0) -> None:
+    super().__init__(latency)
+    self.imported = 0
+    self.resolved = 0
+
+  def batch_import_findings(self, Findings, **kwargs):
+    self._call('batch_import_findings')
+    with self._lock:
+      self.imported += len(Findings)
+    return {'FailedCount': 0, 'SuccessCount': len(Findings), 'FailedFindings': []}
+
+  def batch_update_findings(self, FindingIdentifiers, **kwargs):
+    self._call('batch_update_findings')
+    with self._lock:
+      self.resolved += len(FindingIdentifiers)
+    return {'ProcessedFindings': list(FindingIdentifiers), 'UnprocessedFindings': []}
+
+class FakeAws:
+  """
+  In-memory SSM, SQS, STS and Security Hub. install() routes boto3.client,
+  and with it the shared client registry, to these fakes.
+  """
+  def __init__(self, parameters: dict, latency: float = 0.0) -> None:
+    self.ssm = FakeSsm(parameters, latency)
+    self.sqs = FakeSqs(latency)
+    self.sts = FakeSts(latency)
+    self.securityhub = FakeSecurityHub(latency)
+    self.__original_client = None
+
+  def client(self, service_name: str, *args, **kwargs):
+    fake = getattr(self, service_name, None)
+    if not isinstance(fake, FakeClient):
+      raise ValueError(f"{service_name} is not faked")
+    return fake
+
+  def install(self) -> "FakeAws":
+    self.__original_client = boto3.client
+    boto3.client = self.client
+    return self
+
+  def uninstall(self) -> None:
+    if self.__original_client is not None:
+      boto3.client = self.__original_client
+      self.__original_client = None
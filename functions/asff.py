@@ -0,0 +1,160 @@
+import os
+import json
+from json.encoder import encode_basestring_ascii
+from functools import lru_cache
+from control_event import ControlEvent, ControlSnapshot
+
+TURBOT_PRODUCT_ACCOUNT = "453761072151"
+
+# Constant parts of every finding. They are shared between findings, so
+# callers must treat built findings as read-only.
+SEVERITY = {
+  "Label": "HIGH",
+  "Product": 80
+}
+COMPLIANCE = {
+  "Status": "WARNING"
+}
+TYPES = ["Software and Configuration Checks/Governance/Out of Compliance"]
+RESOURCE_TAGS = {
+  "Source": "Turbot-Sec-Hub-Integration"
+}
+
+@lru_cache(maxsize=1024)
+def get_control_type_fields(control_type: str, state: str = "alarm") -> tuple:
+  """
+  Title and GeneratorId for a control type title and state, computed once
+  per pair. OK controls are titled "OK: ..." so the Security Hub function
+  resolves their finding instead of importing it.
+  """
+  generator_id = control_type.replace(" > ", "-").replace(" ", "-").lower()
+  prefix = "OK" if state == "ok" else "Alarm"
+  return f"{prefix}: {control_type}", f"arn:aws:securityhub:::ruleset/turbot/{generator_id}"
+
+@lru_cache(maxsize=1024)
+def get_control_type_json(control_type: str, state: str = "alarm") -> tuple:
+  """JSON encoded Title and GeneratorId splices for a control type title and state."""
+  title, generator_id = get_control_type_fields(control_type, state)
+  return encode_basestring_ascii(title), encode_basestring_ascii(generator_id)
+
+class FindingFactory:
+  """
+  Builds ASFF findings for control events. The product ARN is worked out
+  once per factory and the per control type fields once per title, so each
+  call only fills in the fields that depend on the event.
+  """
+  def __init__(self, region: str) -> None:
+    if not region or type(region) is not str:
+      raise ValueError("region is missing or not string type")
+
+    self.__product_arn = f"arn:aws:securityhub:{region}:{TURBOT_PRODUCT_ACCOUNT}:product/turbot/turbot"
+    # Constant JSON between the variable fields, rendered with json.dumps
+    # itself so the spliced output matches json.dumps(build(...)) exactly
+    skeleton = json.dumps({
+      "SchemaVersion": "2018-10-08",
+      "Severity": SEVERITY,
+      "Compliance": COMPLIANCE,
+      "Types": TYPES
+    })
+    self.__json_prefix = skeleton[:-1] + ', "Id": '
+    self.__json_product_arn = f', "ProductArn": {encode_basestring_ascii(self.__product_arn)}, "AwsAccountId": '
+    self.__json_aka_prefix = '{"Type": "Resource AKA", "Id": '
+    self.__json_aka_tags = ', "Tags": ' + json.dumps(RESOURCE_TAGS)
+
+  def get_product_arn(self) -> str:
+    return self.__product_arn
+
+  def build(self, event: ControlEvent, snapshot: ControlSnapshot) -> dict:
+    aws = event.aws
+    region = aws.region_name if aws.region_name is not None else "global"
+    finding_id = f"arn:aws:securityhub:{region}:{aws.account_id}:turbot/{event.control_id}"
+    title, generator_id = get_control_type_fields(event.control_type_title, event.state)
+    resources = []
+    for aka in snapshot.akas:
+      resource_aka = {
+        "Type": "Resource AKA",
+        "Id": aka,
+        "Tags": RESOURCE_TAGS
+      }
+      if aws.partition is not None:
+        resource_aka["Partition"] = aws.partition
+      if aws.region_name is not None:
+        resource_aka["Region"] = aws.region_name
+      resources.append(resource_aka)
+    resources.append({
+      "Type": "Resource ID",
+      "Id": finding_id
+    })
+    return {
+      "SchemaVersion": "2018-10-08",
+      "Severity": SEVERITY,
+      "Compliance": COMPLIANCE,
+      "Types": TYPES,
+      "Id": finding_id,
+      "CreatedAt": event.create_timestamp,
+      "UpdatedAt": event.create_timestamp,
+      "ProductArn": self.__product_arn,
+      "AwsAccountId": aws.account_id,
+      "Description": event.reason if event.reason else "No reason given",
+      "Title": title,
+      "Resources": resources,
+      "GeneratorId": generator_id
+    }
+
+  def build_many(self, pairs: list) -> list:
+    """Build findings for a list of (event, snapshot) pairs."""
+    build = self.build
+    return [build(event, snapshot) for event, snapshot in pairs]
+
+  def serialize(self, event: ControlEvent, snapshot: ControlSnapshot) -> str:
+    """
+    JSON text of build(event, snapshot), equal to json.dumps of the finding,
+    spliced from precompiled fragments instead of encoding the dict. Falls
+    back to json.dumps when a variable field is not a string.
+    """
+    aws = event.aws
+    description = event.reason if event.reason else "No reason given"
+    values = [aws.account_id, event.control_id, event.create_timestamp, description, event.control_type_title]
+    values.extend(snapshot.akas)
+    optional = [value for value in (aws.partition, aws.region_name) if value is not None]
+    if any(type(value) is not str for value in values + optional):
+      return json.dumps(self.build(event, snapshot))
+
+    region = aws.region_name if aws.region_name is not None else "global"
+    finding_id = encode_basestring_ascii(f"arn:aws:securityhub:{region}:{aws.account_id}:turbot/{event.control_id}")
+    timestamp = encode_basestring_ascii(event.create_timestamp)
+    title, generator_id = get_control_type_json(event.control_type_title, event.state)
+    location = ""
+    if aws.partition is not None:
+      location += ', "Partition": ' + encode_basestring_ascii(aws.partition)
+    if aws.region_name is not None:
+      location += ', "Region": ' + encode_basestring_ascii(aws.region_name)
+    resources = [
+      self.__json_aka_prefix + encode_basestring_ascii(aka) + self.__json_aka_tags + location + "}"
+      for aka in snapshot.akas
+    ]
+    resources.append('{"Type": "Resource ID", "Id": ' + finding_id + "}")
+    return "".join((
+      self.__json_prefix, finding_id,
+      ', "CreatedAt": ', timestamp,
+      ', "UpdatedAt": ', timestamp,
+      self.__json_product_arn, encode_basestring_ascii(aws.account_id),
+      ', "Description": ', encode_basestring_ascii(description),
+      ', "Title": ', title,
+      ', "Resources": [', ", ".join(resources), "]",
+      ', "GeneratorId": ', generator_id,
+      "}"
+    ))
+
+  def serialize_many(self, pairs: list) -> list:
+    """Serialize findings for a list of (event, snapshot) pairs."""
+    serialize = self.serialize
+    return [serialize(event, snapshot) for event, snapshot in pairs]
+
+_factory = None
+
+def get_finding_factory() -> FindingFactory:
+  global _factory
+  if _factory is None:
+    _factory = FindingFactory(os.environ['AWS_REGION'])
+  return _factory
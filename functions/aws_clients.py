@@ -0,0 +1,130 @@
+import os
+import time
+import threading
+import boto3
+from collections import OrderedDict
+from logger import get_logger
+
+# Maximum number of assumed role clients kept warm per service
+ROLE_CLIENT_POOL_SIZE = int(os.environ.get('ROLE_CLIENT_POOL_SIZE', '50'))
+
+logger = get_logger("clients")
+
+class ClientRegistry:
+  """
+  Lazily created boto3 clients shared by every module in the container.
+
+  Clients are keyed by (service, region, credentials) so a client is built,
+  and its botocore service model loaded, once per container instead of once
+  per record or invocation. boto3 clients are thread safe once created; the
+  lock only guards creation.
+  """
+  def __init__(self) -> None:
+    self.__clients = {}
+    self.__lock = threading.Lock()
+
+  def get_client(self, service: str, region_name: str = None, aws_access_key_id: str = None,
+                 aws_secret_access_key: str = None, aws_session_token: str = None):
+    if not service or type(service) is not str:
+      raise ValueError("service is missing or not string type")
+
+    key = (service, region_name, aws_access_key_id, aws_secret_access_key, aws_session_token)
+    client = self.__clients.get(key)
+    if client is None:
+      with self.__lock:
+        client = self.__clients.get(key)
+        if client is None:
+          client = boto3.client(
+            service,
+            region_name=region_name,
+            aws_access_key_id=aws_access_key_id,
+            aws_secret_access_key=aws_secret_access_key,
+            aws_session_token=aws_session_token
+          )
+          self.__clients[key] = client
+    return client
+
+  def clear(self) -> None:
+    with self.__lock:
+      self.__clients.clear()
+
+CLIENTS = ClientRegistry()
+
+def get_client(service: str, region_name: str = None, **credentials):
+  return CLIENTS.get_client(service, region_name=region_name, **credentials)
+
+class RoleClientPool:
+  """
+  Bounded LRU of clients for one service built from assumed role
+  credentials, keyed by (account, role ARN, region, credential generation).
+
+  Repeated calls into the same account reuse the client's warm HTTPS
+  connections and loaded service model. A client is closed when it falls
+  out of the LRU, when its credentials expire, or when newer credentials
+  for the same account, role and region replace it. Generations are only
+  counted per account and role, so the role ARN is part of the key.
+  """
+  def __init__(self, service: str, max_size: int = ROLE_CLIENT_POOL_SIZE) -> None:
+    if not service or type(service) is not str:
+      raise ValueError("service is missing or not string type")
+
+    self.__service = service
+    self.__max_size = max_size
+    self.__entries = OrderedDict()
+    self.__lock = threading.Lock()
+    self.__stats = {"hits": 0, "misses": 0, "evictions": 0}
+
+  def __close(self, key: tuple, entry: dict) -> None:
+    logger.debug("Closing %s client for %s", self.__service, key)
+    self.__stats["evictions"] += 1
+    close = getattr(entry["client"], "close", None)
+    if close is not None:
+      close()
+
+  def get_client(self, credentials, region_name: str):
+    key = (credentials.account_id, credentials.role_arn, region_name, credentials.generation)
+    with self.__lock:
+      entry = self.__entries.get(key)
+      if entry is not None and entry["expiration"] <= time.time():
+        del self.__entries[key]
+        self.__close(key, entry)
+        entry = None
+      if entry is not None:
+        self.__entries.move_to_end(key)
+        self.__stats["hits"] += 1
+        return entry["client"]
+      self.__stats["misses"] += 1
+    client = boto3.client(
+      self.__service,
+      region_name=region_name,
+      aws_access_key_id=credentials.access_key_id,
+      aws_secret_access_key=credentials.secret_access_key,
+      aws_session_token=credentials.session_token
+    )
+    with self.__lock:
+      entry = self.__entries.get(key)
+      if entry is not None:
+        # Built concurrently by another caller, keep theirs
+        self.__entries.move_to_end(key)
+        return entry["client"]
+      now = time.time()
+      for other_key, other in list(self.__entries.items()):
+        replaced = other_key[:3] == key[:3] and other_key[3] < key[3]
+        if replaced or other["expiration"] <= now:
+          del self.__entries[other_key]
+          self.__close(other_key, other)
+      self.__entries[key] = {"client": client, "expiration": credentials.expiration}
+      while len(self.__entries) > self.__max_size:
+        evicted_key, evicted = self.__entries.popitem(last=False)
+        self.__close(evicted_key, evicted)
+    return client
+
+  def clear(self) -> None:
+    with self.__lock:
+      while self.__entries:
+        key, entry = self.__entries.popitem(last=False)
+        self.__close(key, entry)
+
+  def get_stats(self) -> dict:
+    with self.__lock:
+      return dict(self.__stats, size=len(self.__entries))
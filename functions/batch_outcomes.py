@@ -0,0 +1,55 @@
+import os
+from logger import get_logger
+
+# Only enable together with function_response_types = ["ReportBatchItemFailures"]
+# on the event source mapping, otherwise SQS treats a partial response as success
+REPORT_BATCH_ITEM_FAILURES = os.environ.get('REPORT_BATCH_ITEM_FAILURES', 'false').lower() == 'true'
+
+logger = get_logger("batch")
+
+class BatchFailedException(Exception):
+  def __init__(self, *args: object) -> None:
+    super().__init__(*args)
+
+class BatchOutcomes:
+  """
+  Per-record outcome of an SQS batch, keyed by messageId.
+
+  Records default to succeeded; failed records are returned to SQS as
+  batchItemFailures so only they are redelivered. Without the opt-in the
+  whole batch is failed instead, which keeps the old all-or-nothing
+  behaviour for mappings that do not report item failures.
+  """
+  def __init__(self, records: list, metrics=None) -> None:
+    self.__message_ids = [record.get('messageId') for record in records]
+    self.__failures = {}
+    self.__metrics = metrics
+    if metrics is not None:
+      metrics.count("Records", len(self.__message_ids))
+
+  def fail(self, message_id: str, reason: str) -> None:
+    logger.error("Record %s failed: %s", message_id, reason)
+    if message_id not in self.__failures:
+      self.__failures[message_id] = reason
+      if self.__metrics is not None:
+        self.__metrics.count("RecordsFailed")
+
+  def defer(self, message_id: str, reason: str) -> None:
+    """Hand a record back to SQS for a later attempt; reported like a failure."""
+    logger.info("Record %s deferred: %s", message_id, reason)
+    if message_id not in self.__failures:
+      self.__failures[message_id] = reason
+      if self.__metrics is not None:
+        self.__metrics.count("RecordsDeferred")
+
+  def get_failures(self) -> dict:
+    return dict(self.__failures)
+
+  def get_response(self) -> dict:
+    failed = [message_id for message_id in self.__message_ids if message_id in self.__failures]
+    logger.info("%d of %d records succeeded", len(self.__message_ids) - len(failed), len(self.__message_ids))
+    if failed and not REPORT_BATCH_ITEM_FAILURES:
+      raise BatchFailedException(f"{len(failed)} records failed: {failed}")
+    return {
+      "batchItemFailures": [{"itemIdentifier": message_id} for message_id in failed]
+    }
@@ -0,0 +1,53 @@
+class AwsLocation:
+  """Where the controlled resource lives, from resource.metadata.aws."""
+  __slots__ = ("account_id", "partition", "region_name")
+
+  def __init__(self, account_id: str, partition: str = None, region_name: str = None) -> None:
+    self.account_id = account_id
+    self.partition = partition
+    self.region_name = region_name
+
+  @classmethod
+  def from_metadata(cls, aws_metadata: dict) -> "AwsLocation":
+    return cls(
+      aws_metadata["accountId"],
+      aws_metadata.get("partition"),
+      aws_metadata.get("regionName")
+    )
+
+class ControlSnapshot:
+  """Current state of a control as returned by the Turbot GraphQL API."""
+  __slots__ = ("state", "akas")
+
+  def __init__(self, state: str, akas: list) -> None:
+    self.state = state
+    self.akas = akas
+
+class ControlEvent:
+  """
+  A control_updated notification reduced to the fields the filter, the
+  batch deduplication and the ASFF builder use. Built once per record;
+  control fields stay None for other notification types.
+  """
+  __slots__ = (
+    "message_id", "notification_type", "control_id", "state", "old_state", "reason",
+    "control_type_title", "new_version_id", "old_version_id", "create_timestamp", "aws",
+    "sns_message_id", "sns_timestamp", "received_at"
+  )
+
+  def __init__(self, message_id: str, notification_type: str) -> None:
+    self.message_id = message_id
+    self.notification_type = notification_type
+    self.control_id = None
+    self.state = None
+    self.old_state = None
+    self.reason = None
+    self.control_type_title = None
+    self.new_version_id = None
+    self.old_version_id = None
+    self.create_timestamp = None
+    self.aws = None
+    # Origin timestamps and correlation id carried to the Security Hub function
+    self.sns_message_id = None
+    self.sns_timestamp = None
+    self.received_at = None
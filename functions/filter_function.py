@@ -1,30 +1,112 @@
 import os
 import json
-import boto3
+import time
+import math
+import asyncio
+import threading
 import requests
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from requests.adapters import HTTPAdapter
 from botocore.exceptions import ClientError
+from aws_clients import get_client
+from batch_outcomes import BatchOutcomes
+from asff import get_finding_factory
+from control_event import ControlEvent, ControlSnapshot
+from latency import build_origin_attributes, now_ms
+from notification_parser import parse_record
+from logger import get_logger, log_payload
+from metrics import Metrics
+from ssm_params import get_parameter_cache
 
-def get_param(ssm_client, param_name, encrypted):
-  print("in get_param function")
-  response = ssm_client.get_parameter(
-    Name=param_name,
-    WithDecryption=encrypted
-  )
-  print("after response")
-  return response['Parameter']['Value']
+# Maximum number of aliased control lookups sent in a single GraphQL document
+GRAPHQL_ALIAS_LIMIT = int(os.environ.get('GRAPHQL_ALIAS_LIMIT', '25'))
+# SendMessageBatch limits: 10 entries and 256 KB of bodies plus attributes
+SQS_BATCH_MAX_ENTRIES = 10
+SQS_BATCH_MAX_BYTES = 262144
+# Connection pool settings for the long-lived GraphQL HTTP session
+GRAPHQL_POOL_SIZE = int(os.environ.get('GRAPHQL_POOL_SIZE', '10'))
+GRAPHQL_CONNECT_TIMEOUT = float(os.environ.get('GRAPHQL_CONNECT_TIMEOUT', '3.05'))
+GRAPHQL_READ_TIMEOUT = float(os.environ.get('GRAPHQL_READ_TIMEOUT', '20'))
+GRAPHQL_IDLE_TIMEOUT = float(os.environ.get('GRAPHQL_IDLE_TIMEOUT', '60'))
+# Parallel GraphQL lookups when a batch needs more than one document
+GRAPHQL_CONCURRENCY = int(os.environ.get('GRAPHQL_CONCURRENCY', '4'))
+GRAPHQL_REQUEST_TIMEOUT = float(os.environ.get('GRAPHQL_REQUEST_TIMEOUT', '25'))
+# "threaded" (default) or "asyncio" for the cooperative pipeline, and its
+# limit on in-flight GraphQL/SQS calls
+FILTER_MODE = os.environ.get('FILTER_MODE', 'threaded').lower()
+FILTER_ASYNC_CONCURRENCY = int(os.environ.get('FILTER_ASYNC_CONCURRENCY', '8'))
+# "json" encodes each finding dict, "template" splices precompiled JSON fragments
+FINDING_SERIALIZER = os.environ.get('FINDING_SERIALIZER', 'json').lower()
+
+logger = get_logger("filter")
+# Control version cache: max entries, entry lifetime and how long a looked up
+# state can stand in for a fresh GraphQL lookup
+CONTROL_CACHE_SIZE = int(os.environ.get('CONTROL_CACHE_SIZE', '10000'))
+CONTROL_CACHE_TTL = float(os.environ.get('CONTROL_CACHE_TTL', '3600'))
+CONTROL_CONFIRM_TTL = float(os.environ.get('CONTROL_CONFIRM_TTL', '60'))
 
 class GraphQlException(Exception):
   def __init__(self, *args: object) -> None:
     super().__init__(*args)
 
+class GraphQlAuthException(GraphQlException):
+  def __init__(self, *args: object) -> None:
+    super().__init__(*args)
+
+class GraphQlSession:
+  """
+  Keep-alive HTTP session shared by every GraphQl client in the container.
+
+  Connections idle for longer than idle_timeout are dropped and a fresh
+  session is created, so warm Lambda containers do not reuse sockets the
+  workspace load balancer has already closed.
+  """
+  def __init__(self, pool_size: int, idle_timeout: float) -> None:
+    self.__pool_size = pool_size
+    self.__idle_timeout = idle_timeout
+    self.__session = None
+    self.__last_used = 0.0
+    self.__lock = threading.Lock()
+
+  def __new_session(self) -> requests.Session:
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.__pool_size)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+  def get_session(self) -> requests.Session:
+    with self.__lock:
+      now = time.monotonic()
+      if self.__session is not None and now - self.__last_used > self.__idle_timeout:
+        logger.debug("Recycling idle GraphQL session")
+        self.__session.close()
+        self.__session = None
+      if self.__session is None:
+        self.__session = self.__new_session()
+      self.__last_used = now
+      return self.__session
+
+  def close(self) -> None:
+    with self.__lock:
+      if self.__session is not None:
+        self.__session.close()
+        self.__session = None
+
+# Created at import so warm containers reuse open TCP/TLS connections
+GRAPHQL_SESSION = GraphQlSession(GRAPHQL_POOL_SIZE, GRAPHQL_IDLE_TIMEOUT)
+
 class GraphQl:
-  def __init__(self, workspace: dict) -> None:
+  def __init__(self, workspace: dict, session: GraphQlSession = None) -> None:
     if not workspace or type(workspace) is not dict:
       raise ValueError("workspace is missing or not dict type")
 
     self.__endpoint = workspace['endpoint']
     self.__access_key = workspace['access_key']
     self.__secret_access_key = workspace['secret_key']
+    self.__session = session or GRAPHQL_SESSION
+    self.__timeout = (GRAPHQL_CONNECT_TIMEOUT, GRAPHQL_READ_TIMEOUT)
 
   def get_endpoint(self) -> str:
     return self.__endpoint
@@ -35,7 +117,7 @@ class GraphQl:
   def get_secret_access_key(self) -> str:
     return self.__secret_access_key
 
-  def run_query(self, query: str, variables: dict) -> dict:
+  def run_query(self, query: str, variables: dict, allow_errors: bool = False) -> dict:
     if not query or type(query) is not str:
       raise ValueError("query is missing or not string type")
 
@@ -44,193 +126,585 @@ class GraphQl:
 
     # print(f"Query: {query}")
     # print(f"Variables: {variables}")
-    response = requests.post(
+    response = self.__session.get_session().post(
       self.get_endpoint(),
       auth=(self.get_access_key(), self.get_secret_access_key()),
-      json={'query': query, 'variables': variables}
+      json={'query': query, 'variables': variables},
+      timeout=self.__timeout
     )
 
-    if response.status_code != 200 or response.json().get("errors"):
-      print("GraphQL query failed, throwing exception")
+    if response.status_code in (401, 403):
+      logger.warning("GraphQL authentication failed, throwing exception")
+      raise GraphQlAuthException(f"Query unauthorized: {response.text}")
+
+    if response.status_code != 200:
+      logger.error("GraphQL query failed with status %s, throwing exception", response.status_code)
       raise GraphQlException(f"Query failed: {response.text}")
 
+    response_text = response.text
     response = response.json()
-    print(f"Query result: {response}")
+    if response.get("errors") and not (allow_errors and response.get("data")):
+      logger.error("GraphQL query failed, throwing exception")
+      raise GraphQlException(f"Query failed: {response_text}")
+
+    log_payload(logger, "Query result", response)
 
     return response
 
-def get_control(gql, control_id):
-  print("Function: get_control_state")
-  query = '''
-    query Control($id: ID) {
-      control(id: $id) {
-        state
-        resource {
-          akas
-        }
+def parse_version_id(version_id):
+  if version_id and str(version_id).isdigit():
+    return int(version_id)
+  return None
+
+class ControlVersionCache:
+  """
+  Bounded LRU of the highest control version id seen per control id, with
+  the state and akas Turbot confirmed for it.
+
+  Lets warm containers drop events older than a version they already
+  processed, and reuse a recent confirmation instead of querying Turbot
+  again for the same version and state.
+  """
+  def __init__(self, max_size: int, ttl: float, confirm_ttl: float) -> None:
+    self.__max_size = max_size
+    self.__ttl = ttl
+    self.__confirm_ttl = confirm_ttl
+    self.__entries = OrderedDict()
+    self.__lock = threading.Lock()
+    self.__stats = {"hits": 0, "misses": 0, "stale": 0, "evictions": 0}
+
+  def __get_entry(self, control_id: str, now: float):
+    entry = self.__entries.get(control_id)
+    if entry is None:
+      return None
+    if now - entry["seen_at"] > self.__ttl:
+      del self.__entries[control_id]
+      return None
+    self.__entries.move_to_end(control_id)
+    return entry
+
+  def is_stale(self, control_id: str, version_id: str) -> bool:
+    version = parse_version_id(version_id)
+    if version is None:
+      return False
+    with self.__lock:
+      entry = self.__get_entry(control_id, time.monotonic())
+      if entry is not None and version < entry["version"]:
+        self.__stats["stale"] += 1
+        return True
+    return False
+
+  def get_confirmed(self, control_id: str, version_id: str, state: str):
+    version = parse_version_id(version_id)
+    now = time.monotonic()
+    with self.__lock:
+      entry = self.__get_entry(control_id, now)
+      if (
+        version is not None and entry is not None
+        and entry["version"] == version
+        and entry["state"] == state
+        and entry["confirmed_at"] is not None
+        and now - entry["confirmed_at"] <= self.__confirm_ttl
+      ):
+        self.__stats["hits"] += 1
+        return entry["snapshot"]
+      self.__stats["misses"] += 1
+    return None
+
+  def record(self, control_id: str, version_id: str, snapshot: ControlSnapshot = None) -> None:
+    """
+    Remember version_id as seen for the control. Passing the snapshot Turbot
+    returned for that version also marks it as confirmed.
+    """
+    version = parse_version_id(version_id)
+    if version is None:
+      return
+    now = time.monotonic()
+    with self.__lock:
+      entry = self.__get_entry(control_id, now)
+      if entry is not None and version < entry["version"]:
+        return
+      self.__entries[control_id] = {
+        "version": version,
+        "state": snapshot.state if snapshot is not None else None,
+        "snapshot": snapshot,
+        "seen_at": now,
+        "confirmed_at": now if snapshot is not None else None
       }
-    }
-  '''
-  vars = {"id": control_id}  
-  response = gql.run_query(query, vars)
-
-  if "data" in response:
-    print(f"Success: Control Found")
-    status = response["data"]["control"]["state"]
-    akas = response["data"]["control"]["resource"]["akas"]
-    print(f"Control State = {status}")
-    return {
-      "state": status,
-      "akas": akas
-    }
+      self.__entries.move_to_end(control_id)
+      while len(self.__entries) > self.__max_size:
+        self.__entries.popitem(last=False)
+        self.__stats["evictions"] += 1
+
+  def get_stats(self) -> dict:
+    with self.__lock:
+      return dict(self.__stats, size=len(self.__entries))
+
+CONTROL_CACHE = ControlVersionCache(CONTROL_CACHE_SIZE, CONTROL_CACHE_TTL, CONTROL_CONFIRM_TTL)
+
+def get_control_chunk(gql, chunk, metrics=None):
+  params = []
+  fields = []
+  vars = {}
+  for index, control_id in enumerate(chunk):
+    alias = f"c{index}"
+    params.append(f"${alias}: ID")
+    fields.append(f"{alias}: control(id: ${alias}) {{ state resource {{ akas }} }}")
+    vars[alias] = control_id
+  query = f"query Controls({', '.join(params)}) {{ {' '.join(fields)} }}"
+  controls = {}
+  start = time.perf_counter()
+  try:
+    response = gql.run_query(query, vars, allow_errors=True)
+  except GraphQlAuthException:
+    raise
+  except (GraphQlException, requests.exceptions.RequestException) as e:
+    if metrics is not None:
+      metrics.count("GraphQlErrors")
+    logger.error("Control lookup failed for %d controls: %s", len(chunk), e)
+    return {control_id: None for control_id in chunk}
+  finally:
+    if metrics is not None:
+      metrics.add_timing("GraphQlLookup", (time.perf_counter() - start) * 1000)
+  data = response.get("data") or {}
+  for index, control_id in enumerate(chunk):
+    control = data.get(f"c{index}")
+    if not control:
+      logger.warning("Control %s not found", control_id)
+      controls[control_id] = False
+      continue
+    controls[control_id] = ControlSnapshot(control["state"], control["resource"]["akas"])
+  if response.get("errors"):
+    logger.warning("Control lookup returned errors", extra={"fields": {"errors": response["errors"]}})
+  return controls
+
+_executor = None
+_executor_lock = threading.Lock()
+
+def get_executor():
+  global _executor
+  with _executor_lock:
+    if _executor is None:
+      _executor = ThreadPoolExecutor(max_workers=GRAPHQL_CONCURRENCY, thread_name_prefix="graphql")
+    return _executor
+
+_async_executor = None
+
+def get_async_executor():
+  """Threads the asyncio pipeline runs its blocking calls on, kept across invocations."""
+  global _async_executor
+  with _executor_lock:
+    if _async_executor is None:
+      _async_executor = ThreadPoolExecutor(max_workers=FILTER_ASYNC_CONCURRENCY, thread_name_prefix="filter-async")
+    return _async_executor
+
+def chunk_control_ids(control_ids, alias_limit=None):
+  """Unique control ids, in order, split into lookup documents of alias_limit aliases."""
+  alias_limit = alias_limit or GRAPHQL_ALIAS_LIMIT
+  unique_ids = list(dict.fromkeys(control_ids))
+  return [unique_ids[start:start + alias_limit] for start in range(0, len(unique_ids), alias_limit)]
+
+def get_controls(gql, control_ids, alias_limit=None, metrics=None):
+  """
+  Look up many controls with aliased GraphQL documents. Maps each control id
+  to a ControlSnapshot, False when the control was not found, or None when
+  the lookup itself failed and the record should be retried.
+
+  When the ids need more than one document, the documents are sent in
+  parallel on a bounded thread pool sharing the pooled HTTP session.
+  """
+  logger.debug("Function: get_controls")
+  chunks = chunk_control_ids(control_ids, alias_limit)
+  controls = {}
+  if len(chunks) <= 1 or GRAPHQL_CONCURRENCY <= 1:
+    for chunk in chunks:
+      controls.update(get_control_chunk(gql, chunk, metrics))
   else:
-    print("ERROR: Control Not Found")
-    print(f"ControlId: {control_id}")
-    print(response["errors"])
-    return False
+    executor = get_executor()
+    futures = [executor.submit(get_control_chunk, gql, chunk, metrics) for chunk in chunks]
+    # Requests beyond the pool size queue behind earlier ones, allow one timeout per wave
+    waves = math.ceil(len(chunks) / GRAPHQL_CONCURRENCY)
+    deadline = time.monotonic() + GRAPHQL_REQUEST_TIMEOUT * waves
+    for chunk, future in zip(chunks, futures):
+      try:
+        controls.update(future.result(timeout=max(0.0, deadline - time.monotonic())))
+      except FutureTimeoutError:
+        logger.error("Control lookup timed out for %d controls", len(chunk))
+        future.cancel()
+        controls.update({control_id: None for control_id in chunk})
+  logger.info("Looked up %d controls in %d documents", len(controls), len(chunks))
+  return controls
 
-def convert_to_asff(timestamp, control, aws_metadata, resource_akas):
-  finding = {
-    "SchemaVersion": "2018-10-08",
-    "Severity": {
-      "Label": "HIGH",
-      "Product": 80
-    },
-    "Compliance": {
-      "Status": "WARNING"
-    },
-    "Types": ["Software and Configuration Checks/Governance/Out of Compliance"]
-  }
-  control_id = control["turbot"]["id"]
-  region = aws_metadata["regionName"] if "regionName" in aws_metadata else "global"
-  account_id = aws_metadata["accountId"]
-  finding["Id"] = f"arn:aws:securityhub:{region}:{account_id}:turbot/{control_id}"
-  finding["CreatedAt"] = timestamp
-  finding["UpdatedAt"] = timestamp
-  AWS_REGION = os.environ['AWS_REGION']
-  finding["ProductArn"] = f"arn:aws:securityhub:{AWS_REGION}:453761072151:product/turbot/turbot"
-  finding["AwsAccountId"] = account_id
-  control_reason = control["reason"]
-  finding["Description"] = control_reason if control_reason else "No reason given"
-  control_type = control["type"]["trunk"]["title"]
-  finding["Title"] = f"Alarm: {control_type}"
-  resources = []
-  for aka in resource_akas:
-    resource_aka = {
-      "Type": "Resource AKA",
-      "Id": aka,
-      "Tags": {
-        "Source": "Turbot-Sec-Hub-Integration"
+def convert_to_asff(event: ControlEvent, snapshot: ControlSnapshot) -> dict:
+  finding = get_finding_factory().build(event, snapshot)
+  log_payload(logger, "Create finding complete", finding)
+  return finding
+
+def filter_notification_type(record):
+  if record.notification_type != "control_updated":
+    return f"Notification type is not control_updated | Notification type: {record.notification_type}"
+
+def filter_not_aws(record):
+  if record.aws is None:
+    return "Cloud provider not AWS"
+
+def filter_state_unchanged(record):
+  if record.state == record.old_state:
+    return f"Control states HAVE NOT changed | Event State: {record.state} | Old State: {record.old_state}"
+
+def filter_state_not_alarm_or_ok(record):
+  if record.state not in ["alarm", "ok"]:
+    return f"Control not ALARM or OK | Event State: {record.state}"
+
+def filter_ok_without_alarm(record):
+  if (record.state == "ok") and (record.old_state != "alarm"):
+    return f"Control is OK, but previous control state is not ALARM | Event State: {record.state} | Old State: {record.old_state}"
+
+def filter_control_missing(record, curr_control):
+  if not curr_control:
+    return "No Control State"
+
+def filter_state_mismatch(record, curr_control):
+  if record.state != curr_control.state:
+    return f"Control states DO NOT match | Current State: {curr_control.state} | Event State: {record.state}"
+
+# Checks that only need the notification payload, run before any network I/O
+PRE_FILTERS = [
+  filter_notification_type,
+  filter_not_aws,
+  filter_state_unchanged,
+  filter_state_not_alarm_or_ok,
+  filter_ok_without_alarm
+]
+
+# Checks against the current control state looked up from Turbot
+POST_FILTERS = [
+  filter_control_missing,
+  filter_state_mismatch
+]
+
+def get_filter_metric(filter):
+  # filter_state_mismatch -> FilteredStateMismatch
+  return "Filtered" + "".join(part.title() for part in filter.__name__.split("_")[1:])
+
+def apply_filters(filters, *args, metrics=None):
+  """
+  Run the filters in order and return the reason of the first one that
+  rejects the event, or None when the event passes them all.
+  """
+  for filter in filters:
+    reason = filter(*args)
+    if reason:
+      logger.debug("FILTER: %s, Skipping Event", reason)
+      if metrics is not None:
+        metrics.count(get_filter_metric(filter))
+      return reason
+  return None
+
+def get_event_order(record):
+  return (record.create_timestamp, parse_version_id(record.new_version_id) or 0)
+
+def coalesce_candidates(candidates, metrics=None):
+  """
+  Keep only the latest event per control id in the batch, ordered by
+  createTimestamp and then controlNewVersionId. Superseded events are
+  handled by the newer one and need neither a lookup nor a finding.
+  """
+  latest = {}
+  for record in candidates:
+    current = latest.get(record.control_id)
+    if current is None or get_event_order(record) >= get_event_order(current):
+      latest[record.control_id] = record
+  kept = []
+  for record in candidates:
+    if latest[record.control_id] is record:
+      kept.append(record)
+    else:
+      logger.debug("FILTER: Event %s superseded by a newer event for control %s, Skipping Event", record.message_id, record.control_id)
+      if metrics is not None:
+        metrics.count("FilteredSuperseded")
+  return kept
+
+def get_entry_size(entry):
+  size = len(entry['MessageBody'].encode('utf-8'))
+  for name, attribute in entry.get('MessageAttributes', {}).items():
+    size += len(name.encode('utf-8')) + len(attribute['DataType'].encode('utf-8'))
+    size += len(attribute.get('StringValue', '').encode('utf-8'))
+  return size
+
+def chunk_entries(entries):
+  chunk = []
+  chunk_size = 0
+  for entry in entries:
+    entry_size = get_entry_size(entry)
+    if chunk and (len(chunk) == SQS_BATCH_MAX_ENTRIES or chunk_size + entry_size > SQS_BATCH_MAX_BYTES):
+      yield chunk
+      chunk = []
+      chunk_size = 0
+    chunk.append(entry)
+    chunk_size += entry_size
+  if chunk:
+    yield chunk
+
+def send_findings(sqs_client, queue_url, entries):
+  """
+  Send findings with SendMessageBatch and retry failed entries one at a time.
+  Returns the Ids of the entries that could not be delivered.
+  """
+  failed = []
+  for chunk in chunk_entries(entries):
+    retry = []
+    try:
+      response = sqs_client.send_message_batch(QueueUrl=queue_url, Entries=chunk)
+      logger.debug("%d messages sent", len(response.get('Successful', [])))
+      failed_ids = {failure['Id'] for failure in response.get('Failed', [])}
+      retry = [entry for entry in chunk if entry['Id'] in failed_ids]
+      for failure in response.get('Failed', []):
+        logger.warning("Batch entry %s failed: %s %s", failure['Id'], failure.get('Code'), failure.get('Message'))
+    except ClientError as e:
+      logger.error("Could not send message batch to %s: %s", queue_url, e)
+      retry = chunk
+    for entry in retry:
+      try:
+        sqs_client.send_message(
+          QueueUrl=queue_url,
+          MessageAttributes=entry['MessageAttributes'],
+          MessageBody=entry['MessageBody']
+        )
+        logger.info("Message %s sent on retry", entry['Id'])
+      except ClientError as e:
+        logger.error("Could not send message %s to %s: %s", entry['Id'], queue_url, e)
+        failed.append(entry['Id'])
+  return failed
+
+def build_finding_entry(record, curr_controls, outcomes, metrics=None):
+  """
+  Apply the post-lookup filters to a candidate and build its findings queue
+  entry. Returns None when the event is filtered out or its lookup failed.
+  """
+  logger.debug("Checking if latest event for control %s", record.control_id)
+  curr_control = curr_controls.get(record.control_id)
+  if curr_control is None:
+    outcomes.fail(record.message_id, f"Control lookup failed for {record.control_id}")
+    return None
+  if apply_filters(POST_FILTERS, record, curr_control, metrics=metrics):
+    CONTROL_CACHE.record(record.control_id, record.new_version_id)
+    return None
+  CONTROL_CACHE.record(record.control_id, record.new_version_id, curr_control)
+  logger.debug("FILTER: Control %s passes all filters, processing", record.control_id)
+  start = time.perf_counter()
+  if FINDING_SERIALIZER == "template":
+    data = get_finding_factory().serialize(record, curr_control)
+    log_payload(logger, "Create finding complete", data)
+  else:
+    data = json.dumps(convert_to_asff(record, curr_control))
+  if metrics is not None:
+    metrics.add_timing("AsffBuild", (time.perf_counter() - start) * 1000)
+    metrics.count("FindingsBuilt")
+  msg_attributes = build_origin_attributes(record)
+  msg_attributes.update({
+      'account': {
+          'DataType': 'String',
+          'StringValue': record.aws.account_id
       }
+  })
+  if record.aws.partition is not None:
+    msg_attributes['partition'] = {
+        'DataType': 'String',
+        'StringValue': record.aws.partition
+    }
+  if record.aws.region_name is not None:
+    msg_attributes['region'] = {
+        'DataType': 'String',
+        'StringValue': record.aws.region_name
     }
-    if "partition" in aws_metadata:
-      resource_aka["Partition"] = aws_metadata["partition"]
-    if "regionName" in aws_metadata:
-      resource_aka["Region"] = aws_metadata["regionName"]
-    resources.append(resource_aka)
-  resource_id = {
-    "Type": "Resource ID",
-    "Id": finding["Id"]
+  return {
+    'Id': record.message_id,
+    'MessageAttributes': msg_attributes,
+    'MessageBody': data
   }
-  resources.append(resource_id)
-  finding["Resources"] = resources
-  generator_id = control_type.replace(" > ", "-").replace(" ", "-").lower()
-  finding["GeneratorId"] = f"arn:aws:securityhub:::ruleset/turbot/{generator_id}"
-  print("[INFO] Create finding complete")
-  print(finding)
-  return finding
+
+def send_finding_entries(sqs_client, queue_url, entries, outcomes, metrics=None):
+  start = time.perf_counter()
+  failed = send_findings(sqs_client, queue_url, entries)
+  if metrics is not None:
+    metrics.add_timing("SqsSend", (time.perf_counter() - start) * 1000)
+  logger.info("Sent %d of %d findings", len(entries) - len(failed), len(entries))
+  for message_id in failed:
+    outcomes.fail(message_id, "Could not send finding to findings queue")
+
+async def process_candidates_async(workspace, candidates, curr_controls, control_ids, sqs_client, queue_url, outcomes,
+                                   alias_limit=None, metrics=None):
+  """
+  Cooperative version of the lookup, filter and send stages. Lookup documents
+  run concurrently and findings are sent as soon as a full SQS batch is ready,
+  with a single semaphore bounding the in-flight GraphQL and SQS calls.
+
+  Neither the vendored urllib3 nor boto3 offer non-blocking I/O, so each
+  call is awaited on a thread executor sized to the semaphore; the pooled
+  HTTP session keeps its connections across those threads. A lookup that
+  takes longer than GRAPHQL_REQUEST_TIMEOUT is given up, as in get_controls.
+  Chunking and the retry on rejected workspace keys are shared with the
+  threaded path (chunk_control_ids, GraphQlWorkspace).
+  """
+  loop = asyncio.get_running_loop()
+  executor = get_async_executor()
+  semaphore = asyncio.Semaphore(FILTER_ASYNC_CONCURRENCY)
+  candidates_by_control = {}
+  for record in candidates:
+    candidates_by_control.setdefault(record.control_id, []).append(record)
+  pending_entries = []
+  sends = []
+
+  async def send(entries):
+    async with semaphore:
+      await loop.run_in_executor(executor, send_finding_entries, sqs_client, queue_url, entries, outcomes, metrics)
+
+  def collect(controls):
+    for control_id in controls:
+      for record in candidates_by_control.get(control_id, []):
+        entry = build_finding_entry(record, controls, outcomes, metrics)
+        if entry:
+          pending_entries.append(entry)
+    while len(pending_entries) >= SQS_BATCH_MAX_ENTRIES:
+      sends.append(asyncio.create_task(send(pending_entries[:SQS_BATCH_MAX_ENTRIES])))
+      del pending_entries[:SQS_BATCH_MAX_ENTRIES]
+
+  async def lookup(chunk):
+    async with semaphore:
+      try:
+        return await asyncio.wait_for(
+          loop.run_in_executor(executor, workspace.run, lambda gql: get_control_chunk(gql, chunk, metrics)),
+          GRAPHQL_REQUEST_TIMEOUT
+        )
+      except asyncio.TimeoutError:
+        logger.error("Control lookup timed out for %d controls", len(chunk))
+        return {control_id: None for control_id in chunk}
+
+  collect(curr_controls)
+  chunks = chunk_control_ids(control_ids, alias_limit)
+  for lookup_done in asyncio.as_completed([lookup(chunk) for chunk in chunks]):
+    collect(await lookup_done)
+  if pending_entries:
+    sends.append(asyncio.create_task(send(list(pending_entries))))
+  await asyncio.gather(*sends)
+
+def get_workspace(params):
+  workspace_url = params.get('workspace/url')
+  return {
+    "endpoint": workspace_url + "api/v5/graphql",
+    "access_key": params.get('workspace/access_key'),
+    "secret_key": params.get('workspace/secret_key')
+  }
+
+class GraphQlWorkspace:
+  """
+  GraphQl client for the workspace in params. run() retries a lookup once
+  with a client built from reloaded SSM params when the workspace keys are
+  rejected; concurrent lookups rejected by the same client reload only once.
+  """
+  def __init__(self, params) -> None:
+    self.__params = params
+    self.__gql = GraphQl(get_workspace(params))
+    self.__lock = threading.Lock()
+
+  def __refresh(self, rejected: GraphQl) -> GraphQl:
+    with self.__lock:
+      if self.__gql is rejected:
+        logger.warning("Workspace keys rejected, reloading SSM params and retrying")
+        self.__params.refresh()
+        self.__gql = GraphQl(get_workspace(self.__params))
+      return self.__gql
+
+  def run(self, lookup):
+    """Return lookup(gql), retried with refreshed keys on GraphQlAuthException."""
+    gql = self.__gql
+    try:
+      return lookup(gql)
+    except GraphQlAuthException:
+      return lookup(self.__refresh(gql))
 
 def lambda_handler(event, context):
-  print("Parse Lambda Params")
+  metrics = Metrics("filter", {"Workspace": os.environ['WORKSPACE_NAME']})
+  try:
+    return process_batch(event, metrics)
+  finally:
+    metrics.flush()
+
+def process_batch(event, metrics):
+  logger.debug("Parse Lambda Params")
   AWS_REGION = os.environ['AWS_REGION']
   WORKSPACE_NAME = os.environ['WORKSPACE_NAME']
   FINDINGS_QUEUE_URL = os.environ['FINDINGS_QUEUE_URL']
   SSM_PREFIX = "/sechub/integration/"
 
-  print("Parse SSM Params")
-  workspace = {}
-  print("ssm_client")
-  ssm_client = boto3.client('ssm')
-  workspace_url = get_param(ssm_client, f'{SSM_PREFIX}{WORKSPACE_NAME}/workspace/url', True)
-  workspace["endpoint"] = workspace_url + "api/v5/graphql"
-  workspace["access_key"] = get_param(ssm_client, f'{SSM_PREFIX}{WORKSPACE_NAME}/workspace/access_key', True)
-  workspace["secret_key"] = get_param(ssm_client, f'{SSM_PREFIX}{WORKSPACE_NAME}/workspace/secret_key', True)
-  gql = GraphQl(workspace)
-
-  print("Iterate over events")
+  logger.debug("Parse SSM Params")
+  with metrics.timer("SsmLoad"):
+    params = get_parameter_cache(f'{SSM_PREFIX}{WORKSPACE_NAME}/')
+    workspace = GraphQlWorkspace(params)
+
+  logger.info("Processing %d records", len(event['Records']))
+  outcomes = BatchOutcomes(event['Records'], metrics)
+  candidates = []
+  received_at = now_ms()
   for event_record in event['Records']:
     #receipt_handle = event_record['receiptHandle']
-    body = json.loads(event_record['body'])
-    msg_body = json.loads(body['Message'])
-    msg_time = msg_body["turbot"]["createTimestamp"]
-    msg_type = msg_body["notificationType"]
-    if msg_type != "control_updated":
-      print(f"[INFO] Ignore record - Notification type: {msg_type}")
-      continue
-    control = msg_body["control"]
-    print("Parsing Resource Metadata")
-    resource_metadata = control["resource"]["metadata"]
-    if "aws" not in resource_metadata:
-      print(f"[INFO] Ignore record - Cloud provider not AWS")
-      continue
-    aws_metadata = resource_metadata["aws"]
-    print("Checking if latest Event")
-    control_id = control["turbot"]["id"]
-    control_state = control["state"]
-    curr_control = get_control(gql, control_id)
-    if not curr_control:
-      print("FILTER: No Control State, Skipping Event")
-      continue
-    curr_control_state = curr_control["state"]
-    resource_akas = curr_control["akas"]
-    old_control_state = "TBD"
-    if "oldControl" in msg_body:
-      old_control_state = msg_body["oldControl"]["state"]
-    if control_state != curr_control_state:
-      print("FILTER: Control states DO NOT match, Skipping Event")
-      print(f"Current State: {curr_control_state} | Event State: {control_state}")
-      continue
-    if control_state == old_control_state:
-      print("FILTER: Control states HAVE NOT changed, Skipping Event")
-      print(f"Event State: {control_state} | Old State: {old_control_state}")
+    try:
+      with metrics.timer("Parse"):
+        record = parse_record(event_record)
+    except (ValueError, KeyError, TypeError) as e:
+      outcomes.fail(event_record['messageId'], f"Could not parse record: {e!r}")
       continue
-    if control_state not in ["alarm", "ok"]:
-      print("FILTER: Control not ALARM or OK, Skipping Event")
-      print(f"Event State: {control_state}")
+    record.received_at = received_at
+    with metrics.timer("PreFilter"):
+      filtered = apply_filters(PRE_FILTERS, record, metrics=metrics)
+    if filtered:
       continue
-    if (control_state == "ok") and (old_control_state != "alarm"):
-      print("FILTER: Control is OK, but previous control state is not ALARM")
-      print(f"Event State: {control_state} | Old State: {old_control_state}")
+    candidates.append(record)
+
+  candidates = coalesce_candidates(candidates, metrics)
+  if not candidates:
+    logger.info("No candidate events, nothing to look up")
+    return outcomes.get_response()
+
+  logger.debug("Checking control version cache")
+  curr_controls = {}
+  control_ids = []
+  fresh_candidates = []
+  for record in candidates:
+    if CONTROL_CACHE.is_stale(record.control_id, record.new_version_id):
+      logger.debug("FILTER: Event %s is older than a processed version of control %s, Skipping Event", record.message_id, record.control_id)
+      metrics.count("FilteredStale")
       continue
-    print("FILTER: Control Passes All Filters, Processing...")
-    finding = convert_to_asff(msg_time, control, aws_metadata, resource_akas)
-    partition = aws_metadata["partition"] if "partition" in aws_metadata else None
-    region_name = aws_metadata["regionName"] if "regionName" in aws_metadata else None
-    msg_attributes = {
-        'account': {
-            'DataType': 'String',
-            'StringValue': aws_metadata["accountId"]
-        },
-        'partition': {
-            'DataType': 'String',
-            'StringValue': partition
-        },
-        'region': {
-            'DataType': 'String',
-            'StringValue': region_name
-        }
-    }
-    data = json.dumps(finding)
-    print("sqs_client")
-    sqs_client = boto3.client('sqs')
-    try:
-      response = sqs_client.send_message(
-        QueueUrl=FINDINGS_QUEUE_URL,
-        MessageAttributes=msg_attributes,
-        MessageBody=data
-      )
-      print(f"[SUCCESS] Message sent")
-      print(response)
-    except ClientError as e:
-      print(f'Could not send meessage to: {FINDINGS_QUEUE_URL}.')
-      print(e)
+    fresh_candidates.append(record)
+    cached_control = CONTROL_CACHE.get_confirmed(record.control_id, record.new_version_id, record.state)
+    if cached_control:
+      metrics.count("ControlCacheHits")
+      curr_controls[record.control_id] = cached_control
+    else:
+      control_ids.append(record.control_id)
+  candidates = fresh_candidates
+  logger.info("Control version cache", extra={"fields": {"cache": CONTROL_CACHE.get_stats()}})
+
+  sqs_client = get_client('sqs')
+  if FILTER_MODE == "asyncio":
+    logger.debug("Processing candidates in asyncio mode")
+    asyncio.run(process_candidates_async(
+      workspace, candidates, curr_controls, control_ids, sqs_client, FINDINGS_QUEUE_URL, outcomes, metrics=metrics
+    ))
+    return outcomes.get_response()
+
+  if control_ids:
+    logger.debug("Looking up current control states")
+    curr_controls.update(workspace.run(lambda gql: get_controls(gql, control_ids, metrics=metrics)))
+
+  entries = []
+  for record in candidates:
+    entry = build_finding_entry(record, curr_controls, outcomes, metrics)
+    if entry:
+      entries.append(entry)
+
+  if entries:
+    send_finding_entries(sqs_client, FINDINGS_QUEUE_URL, entries, outcomes, metrics)
+
+  return outcomes.get_response()
@@ -0,0 +1,68 @@
+import time
+from datetime import datetime
+
+def iso_to_epoch_ms(timestamp: str):
+  """Epoch milliseconds of an ISO-8601 timestamp such as 2021-02-11T00:36:24.987Z."""
+  if not timestamp:
+    return None
+  try:
+    return int(datetime.fromisoformat(timestamp.replace("Z", "+00:00")).timestamp() * 1000)
+  except (ValueError, TypeError):
+    return None
+
+def now_ms() -> int:
+  return int(time.time() * 1000)
+
+def build_origin_attributes(event) -> dict:
+  """
+  SQS message attributes carrying a ControlEvent's correlation id and origin
+  timestamps (epoch ms) from the filter to the Security Hub function.
+  """
+  attributes = {
+    'correlation_id': {
+      'DataType': 'String',
+      'StringValue': event.sns_message_id or event.message_id
+    }
+  }
+  timestamps = {
+    'turbot_timestamp': iso_to_epoch_ms(event.create_timestamp),
+    'sns_timestamp': iso_to_epoch_ms(event.sns_timestamp),
+    'filter_timestamp': event.received_at
+  }
+  for name, value in timestamps.items():
+    if value is not None:
+      attributes[name] = {
+        'DataType': 'Number',
+        'StringValue': str(value)
+      }
+  return attributes
+
+def get_message_attribute(event_record: dict, name: str):
+  attribute = event_record.get('messageAttributes', {}).get(name)
+  return attribute.get('stringValue') if attribute else None
+
+def get_pipeline_lag(event_record: dict, imported_at: int) -> dict:
+  """
+  Lag in milliseconds of each pipeline hop for a findings queue record:
+  Turbot to SNS, SNS to the filter function, filter to the findings queue,
+  and findings queue to the Security Hub import. A record requeued after a
+  deferral is timed from when it was first queued (queued_timestamp). Hops
+  whose timestamps are missing are left out.
+  """
+  def number(value):
+    return int(value) if value is not None and str(value).isdigit() else None
+
+  turbot = number(get_message_attribute(event_record, 'turbot_timestamp'))
+  sns = number(get_message_attribute(event_record, 'sns_timestamp'))
+  filtered = number(get_message_attribute(event_record, 'filter_timestamp'))
+  queued = number(get_message_attribute(event_record, 'queued_timestamp'))
+  if queued is None:
+    queued = number(event_record.get('attributes', {}).get('SentTimestamp'))
+  hops = {
+    "TurbotToSns": (turbot, sns),
+    "SnsToFilter": (sns, filtered),
+    "FilterToFindingsQueue": (filtered, queued),
+    "FindingsQueueToImport": (queued, imported_at),
+    "EndToEnd": (turbot, imported_at)
+  }
+  return {name: end - start for name, (start, end) in hops.items() if start is not None and end is not None}
@@ -0,0 +1,57 @@
+import os
+import sys
+import json
+import random
+import logging
+
+LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO').upper()
+# Fraction of large payload debug logs (query results, findings, API
+# responses) that are written when DEBUG is enabled
+LOG_PAYLOAD_SAMPLE_RATE = float(os.environ.get('LOG_PAYLOAD_SAMPLE_RATE', '1.0'))
+
+ROOT_LOGGER_NAME = "sechub_integration"
+
+class JsonFormatter(logging.Formatter):
+  """
+  One JSON object per log record. Structured values passed as
+  extra={"fields": {...}} are merged into the object and only serialized
+  when the record is actually emitted.
+  """
+  def format(self, record: logging.LogRecord) -> str:
+    entry = {
+      "level": record.levelname,
+      "logger": record.name,
+      "message": record.getMessage()
+    }
+    fields = getattr(record, "fields", None)
+    if fields:
+      entry.update(fields)
+    if record.exc_info:
+      entry["exception"] = self.formatException(record.exc_info)
+    return json.dumps(entry, default=str)
+
+def __configure_root() -> logging.Logger:
+  root = logging.getLogger(ROOT_LOGGER_NAME)
+  if not root.handlers:
+    handler = logging.StreamHandler(sys.stdout)
+    handler.setFormatter(JsonFormatter())
+    root.addHandler(handler)
+    root.setLevel(LOG_LEVEL)
+    # The Lambda runtime installs its own handler on the root logger
+    root.propagate = False
+  return root
+
+def get_logger(name: str) -> logging.Logger:
+  __configure_root()
+  return logging.getLogger(f"{ROOT_LOGGER_NAME}.{name}")
+
+def log_payload(logger: logging.Logger, message: str, payload) -> None:
+  """
+  Log a large payload at DEBUG, for a LOG_PAYLOAD_SAMPLE_RATE share of calls.
+  Costs one level check when DEBUG is off.
+  """
+  if not logger.isEnabledFor(logging.DEBUG):
+    return
+  if LOG_PAYLOAD_SAMPLE_RATE < 1.0 and random.random() >= LOG_PAYLOAD_SAMPLE_RATE:
+    return
+  logger.debug(message, extra={"fields": {"payload": payload}})
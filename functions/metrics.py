@@ -0,0 +1,89 @@
+import os
+import sys
+import json
+import time
+import threading
+from contextlib import contextmanager
+
+METRICS_ENABLED = os.environ.get('METRICS_ENABLED', 'true').lower() == 'true'
+METRICS_NAMESPACE = os.environ.get('METRICS_NAMESPACE', 'TurbotSecHubIntegration')
+# CloudWatch accepts at most 100 values per metric in one EMF document
+EMF_MAX_VALUES = 100
+
+class Metrics:
+  """
+  Per-invocation stage timings and outcome counters, written as CloudWatch
+  Embedded Metric Format lines by flush(). Timings keep every sample so
+  CloudWatch can compute exact statistics and percentiles across the batch.
+  """
+  def __init__(self, function: str, dimensions: dict = None) -> None:
+    self.__dimensions = {"Function": function}
+    self.__dimensions.update(dimensions or {})
+    self.__timings = {}
+    self.__counts = {}
+    self.__lock = threading.Lock()
+
+  def add_timing(self, stage: str, milliseconds: float) -> None:
+    with self.__lock:
+      self.__timings.setdefault(stage, []).append(round(milliseconds, 3))
+
+  @contextmanager
+  def timer(self, stage: str):
+    start = time.perf_counter()
+    try:
+      yield
+    finally:
+      self.add_timing(stage, (time.perf_counter() - start) * 1000)
+
+  def count(self, name: str, value: int = 1) -> None:
+    with self.__lock:
+      self.__counts[name] = self.__counts.get(name, 0) + value
+
+  def get_counts(self) -> dict:
+    with self.__lock:
+      return dict(self.__counts)
+
+  def __build_document(self, values: dict, units: dict) -> dict:
+    document = dict(self.__dimensions)
+    document.update(values)
+    document["_aws"] = {
+      "Timestamp": int(time.time() * 1000),
+      "CloudWatchMetrics": [{
+        "Namespace": METRICS_NAMESPACE,
+        "Dimensions": [list(self.__dimensions.keys())],
+        "Metrics": [{"Name": name, "Unit": units[name]} for name in values]
+      }]
+    }
+    return document
+
+  def to_emf(self) -> list:
+    """
+    EMF documents holding every timing sample and counter. A stage with
+    more than EMF_MAX_VALUES samples is spread over several documents, so
+    CloudWatch sees every sample and its SampleCount, Sum and percentiles
+    stay exact. Counters go in the first document.
+    """
+    with self.__lock:
+      timings = {f"{stage}Latency": list(values) for stage, values in self.__timings.items()}
+      counts = dict(self.__counts)
+    units = dict.fromkeys(timings, "Milliseconds")
+    units.update(dict.fromkeys(counts, "Count"))
+    documents = []
+    offset = 0
+    while offset == 0 or any(len(values) > offset for values in timings.values()):
+      values = {
+        name: samples[offset:offset + EMF_MAX_VALUES]
+        for name, samples in timings.items() if len(samples) > offset
+      }
+      if offset == 0:
+        values.update(counts)
+      documents.append(self.__build_document(values, units))
+      offset += EMF_MAX_VALUES
+    return documents
+
+  def flush(self) -> None:
+    """Write the EMF documents to stdout, bypassing the log level."""
+    if not METRICS_ENABLED:
+      return
+    sys.stdout.write("".join(json.dumps(document) + "\n" for document in self.to_emf()))
+    sys.stdout.flush()
@@ -0,0 +1,61 @@
+import os
+import re
+import json
+from control_event import AwsLocation, ControlEvent
+from logger import get_logger
+
+try:
+  import orjson
+except ImportError:
+  orjson = None
+
+# "auto" uses orjson when it is packaged with the Lambda, "json" forces the stdlib
+JSON_BACKEND = os.environ.get('JSON_BACKEND', 'auto').lower()
+
+logger = get_logger("parser")
+
+NOTIFICATION_TYPE_PATTERN = re.compile(r'"notificationType"\s*:\s*"([a-z_]*)"')
+
+def get_json_loads(backend: str = JSON_BACKEND):
+  if backend in ('auto', 'orjson') and orjson is not None:
+    return orjson.loads
+  if backend == 'orjson':
+    logger.warning("orjson JSON backend requested but not installed, using json")
+  return json.loads
+
+json_loads = get_json_loads()
+
+def parse_record(event_record: dict) -> ControlEvent:
+  """
+  Parse an SQS record carrying an SNS Turbot notification into a
+  ControlEvent. Records that are not control_updated are recognised from the
+  raw Message text and never decoded further. For the rest, only the fields
+  the pipeline uses are kept, so the actor, details and signature blobs are
+  released straight away.
+  """
+  envelope = json_loads(event_record['body'])
+  message = envelope['Message']
+  match = NOTIFICATION_TYPE_PATTERN.search(message)
+  if match and match.group(1) != "control_updated":
+    return ControlEvent(event_record['messageId'], match.group(1))
+
+  msg_body = json_loads(message)
+  record = ControlEvent(event_record['messageId'], msg_body["notificationType"])
+  if record.notification_type != "control_updated":
+    return record
+
+  record.sns_message_id = envelope.get('MessageId')
+  record.sns_timestamp = envelope.get('Timestamp')
+  turbot = msg_body["turbot"]
+  control = msg_body["control"]
+  record.control_id = control["turbot"]["id"]
+  record.state = control["state"]
+  record.old_state = msg_body["oldControl"]["state"] if "oldControl" in msg_body else "TBD"
+  record.reason = control.get("reason")
+  record.control_type_title = control["type"]["trunk"]["title"]
+  record.new_version_id = turbot.get("controlNewVersionId")
+  record.old_version_id = turbot.get("controlOldVersionId")
+  record.create_timestamp = turbot["createTimestamp"]
+  aws_metadata = control["resource"]["metadata"].get("aws")
+  record.aws = AwsLocation.from_metadata(aws_metadata) if aws_metadata is not None else None
+  return record
@@ -0,0 +1,156 @@
+import os
+import math
+import time
+import random
+import threading
+from botocore.exceptions import ClientError
+from logger import get_logger
+
+# Security Hub quota per account, region and API: requests per second and burst
+SECHUB_RATE_LIMIT = float(os.environ.get('SECHUB_RATE_LIMIT', '10'))
+SECHUB_BURST_LIMIT = float(os.environ.get('SECHUB_BURST_LIMIT', '30'))
+# Longest wait for a token before the work is deferred back to SQS instead
+SECHUB_MAX_WAIT = float(os.environ.get('SECHUB_MAX_WAIT', '2'))
+# Retries of a throttled call, and the backoff base and cap in seconds
+SECHUB_MAX_RETRIES = int(os.environ.get('SECHUB_MAX_RETRIES', '3'))
+SECHUB_BACKOFF_BASE = float(os.environ.get('SECHUB_BACKOFF_BASE', '0.2'))
+SECHUB_BACKOFF_MAX = float(os.environ.get('SECHUB_BACKOFF_MAX', '5'))
+
+THROTTLING_ERROR_CODES = {
+  'Throttling', 'ThrottlingException', 'ThrottledException', 'TooManyRequestsException',
+  'RequestLimitExceeded', 'LimitExceededException'
+}
+
+logger = get_logger("governor")
+
+class DeferredException(Exception):
+  """Raised instead of calling the API when there is no budget left; delay is in seconds."""
+  def __init__(self, delay: float, *args: object) -> None:
+    super().__init__(*args)
+    self.delay = delay
+
+def is_throttling_error(error: ClientError) -> bool:
+  return error.response.get('Error', {}).get('Code') in THROTTLING_ERROR_CODES
+
+def get_backoff(attempt: int) -> float:
+  """Full jitter: a random delay up to the capped exponential backoff."""
+  return random.uniform(0, min(SECHUB_BACKOFF_MAX, SECHUB_BACKOFF_BASE * 2 ** attempt))
+
+class TokenBucket:
+  """
+  Token bucket whose refill rate adapts to throttling: halved on every
+  throttled call, down to a tenth of the configured rate, and grown back
+  by a twentieth of it on every successful call.
+  """
+  def __init__(self, rate: float, capacity: float) -> None:
+    self.__max_rate = rate
+    self.__rate = rate
+    self.__capacity = capacity
+    self.__tokens = capacity
+    self.__updated_at = time.monotonic()
+    self.__lock = threading.Lock()
+
+  def __refill(self, now: float) -> None:
+    self.__tokens = min(self.__capacity, self.__tokens + (now - self.__updated_at) * self.__rate)
+    self.__updated_at = now
+
+  def reserve(self, max_wait: float):
+    """
+    Take a token, returning how long the caller must wait before using it,
+    or None without taking one if that would be longer than max_wait.
+    """
+    with self.__lock:
+      self.__refill(time.monotonic())
+      wait = max(0.0, (1 - self.__tokens) / self.__rate)
+      if wait > max_wait:
+        return None
+      self.__tokens -= 1
+      return wait
+
+  def get_wait(self) -> float:
+    with self.__lock:
+      self.__refill(time.monotonic())
+      return max(0.0, (1 - self.__tokens) / self.__rate)
+
+  def on_throttle(self) -> None:
+    with self.__lock:
+      self.__rate = max(self.__max_rate / 10, self.__rate / 2)
+      self.__tokens = min(self.__tokens, 0.0)
+
+  def on_success(self) -> None:
+    with self.__lock:
+      self.__rate = min(self.__max_rate, self.__rate + self.__max_rate / 20)
+
+  def get_rate(self) -> float:
+    with self.__lock:
+      return self.__rate
+
+class RateGovernor:
+  """
+  Container wide client-side rate limit for Security Hub, with a token
+  bucket per (account, region, API).
+
+  Calls wait for a token when it comes soon enough, and retry throttling
+  errors with jittered exponential backoff. When the wait or backoff would
+  run past the caller's deadline, DeferredException is raised so the caller
+  can hand the records back to SQS rather than sleep away Lambda time.
+  Concurrent containers share the real quota, which the adaptive refill
+  rate of each bucket accounts for.
+  """
+  def __init__(self, rate: float = SECHUB_RATE_LIMIT, burst: float = SECHUB_BURST_LIMIT) -> None:
+    self.__rate = rate
+    self.__burst = burst
+    self.__buckets = {}
+    self.__lock = threading.Lock()
+    self.__stats = {"calls": 0, "waits": 0, "throttled": 0, "deferred": 0}
+
+  def get_bucket(self, key: tuple) -> TokenBucket:
+    with self.__lock:
+      bucket = self.__buckets.get(key)
+      if bucket is None:
+        bucket = self.__buckets[key] = TokenBucket(self.__rate, self.__burst)
+      return bucket
+
+  def __count(self, name: str) -> None:
+    with self.__lock:
+      self.__stats[name] += 1
+
+  def __defer(self, key: tuple, delay: float) -> DeferredException:
+    self.__count("deferred")
+    # Spread redelivery so deferred records do not all come back at once
+    delay = math.ceil(delay + random.uniform(0, SECHUB_BACKOFF_MAX))
+    logger.warning("Deferring %s calls for %d seconds", key, delay)
+    return DeferredException(delay, f"Rate budget for {key} exhausted")
+
+  def call(self, key: tuple, operation, deadline: float = math.inf):
+    """Run operation() under the bucket for key, before the monotonic deadline."""
+    bucket = self.get_bucket(key)
+    attempt = 0
+    while True:
+      wait = bucket.reserve(min(SECHUB_MAX_WAIT, deadline - time.monotonic()))
+      if wait is None:
+        raise self.__defer(key, bucket.get_wait())
+      if wait > 0:
+        self.__count("waits")
+        time.sleep(wait)
+      self.__count("calls")
+      try:
+        response = operation()
+      except ClientError as e:
+        if not is_throttling_error(e):
+          raise
+        self.__count("throttled")
+        bucket.on_throttle()
+        backoff = get_backoff(attempt)
+        attempt += 1
+        logger.warning("%s throttled, attempt %d, rate now %.2f/s", key, attempt, bucket.get_rate())
+        if attempt > SECHUB_MAX_RETRIES or time.monotonic() + backoff > deadline:
+          raise self.__defer(key, max(backoff, bucket.get_wait()))
+        time.sleep(backoff)
+        continue
+      bucket.on_success()
+      return response
+
+  def get_stats(self) -> dict:
+    with self.__lock:
+      return dict(self.__stats, buckets=len(self.__buckets))
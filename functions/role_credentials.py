@@ -0,0 +1,123 @@
+import os
+import time
+import threading
+from aws_clients import get_client
+from logger import get_logger
+
+# Cached credentials are not handed out once they are this close to Expiration
+STS_EXPIRY_MARGIN = float(os.environ.get('STS_EXPIRY_MARGIN', '300'))
+# A background refresh is started this many seconds before the expiry margin
+STS_REFRESH_AHEAD = float(os.environ.get('STS_REFRESH_AHEAD', '600'))
+STS_SESSION_NAME = 'TurbotSecurityHubReporting'
+
+logger = get_logger("sts")
+
+class RoleCredentials:
+  """Temporary credentials for the reporting role in one target account."""
+  __slots__ = (
+    "account_id", "role_arn", "access_key_id", "secret_access_key", "session_token",
+    "expiration", "generation"
+  )
+
+  def __init__(self, account_id: str, role_arn: str, credentials: dict, generation: int) -> None:
+    self.account_id = account_id
+    self.role_arn = role_arn
+    self.access_key_id = credentials['AccessKeyId']
+    self.secret_access_key = credentials['SecretAccessKey']
+    self.session_token = credentials['SessionToken']
+    # Epoch seconds
+    self.expiration = credentials['Expiration'].timestamp()
+    # Increases every time the role is assumed again for the same key
+    self.generation = generation
+
+class RoleCredentialCache:
+  """
+  Container wide cache of assumed role credentials, keyed by account id and
+  role ARN.
+
+  Credentials are reused until STS_EXPIRY_MARGIN seconds before they
+  expire; within STS_REFRESH_AHEAD seconds of that point one background
+  refresh is started. A lock per key makes concurrent callers for the same
+  account wait for a single AssumeRole call instead of each making one.
+  """
+  def __init__(self, sts_client=None) -> None:
+    self.__sts_client = sts_client
+    self.__entries = {}
+    self.__locks = {}
+    self.__refreshing = set()
+    self.__generations = {}
+    self.__lock = threading.Lock()
+    self.__stats = {"hits": 0, "misses": 0, "refreshes": 0}
+
+  def __get_sts_client(self):
+    if self.__sts_client is None:
+      self.__sts_client = get_client('sts')
+    return self.__sts_client
+
+  def __get_key_lock(self, key: tuple) -> threading.Lock:
+    with self.__lock:
+      return self.__locks.setdefault(key, threading.Lock())
+
+  def __assume(self, key: tuple, external_id: str) -> RoleCredentials:
+    account_id, role_arn = key
+    logger.debug("Assuming %s", role_arn)
+    response = self.__get_sts_client().assume_role(
+      RoleArn=role_arn,
+      ExternalId=external_id,
+      RoleSessionName=STS_SESSION_NAME
+    )
+    with self.__lock:
+      generation = self.__generations.get(key, 0) + 1
+      self.__generations[key] = generation
+      credentials = RoleCredentials(account_id, role_arn, response['Credentials'], generation)
+      self.__entries[key] = credentials
+    return credentials
+
+  def __background_refresh(self, key: tuple, external_id: str) -> None:
+    try:
+      with self.__get_key_lock(key):
+        self.__assume(key, external_id)
+    except Exception as e:
+      logger.warning("Background AssumeRole refresh for %s failed: %s", key[1], e)
+    finally:
+      with self.__lock:
+        self.__refreshing.discard(key)
+
+  def get(self, account_id: str, role_name: str, external_id: str) -> RoleCredentials:
+    key = (account_id, f'arn:aws:iam::{account_id}:role/{role_name}')
+    with self.__lock:
+      credentials = self.__entries.get(key)
+      remaining = credentials.expiration - time.time() - STS_EXPIRY_MARGIN if credentials else 0
+      start_refresh = 0 < remaining <= STS_REFRESH_AHEAD and key not in self.__refreshing
+      if start_refresh:
+        self.__refreshing.add(key)
+        self.__stats["refreshes"] += 1
+      if remaining > 0:
+        self.__stats["hits"] += 1
+    if remaining > 0:
+      if start_refresh:
+        threading.Thread(target=self.__background_refresh, args=(key, external_id), daemon=True).start()
+      return credentials
+
+    with self.__get_key_lock(key):
+      with self.__lock:
+        credentials = self.__entries.get(key)
+        if credentials and credentials.expiration - time.time() > STS_EXPIRY_MARGIN:
+          # Another caller assumed the role while this one waited
+          self.__stats["hits"] += 1
+          return credentials
+        self.__stats["misses"] += 1
+      return self.__assume(key, external_id)
+
+  def invalidate(self, account_id: str, role_name: str) -> None:
+    with self.__lock:
+      self.__entries.pop((account_id, f'arn:aws:iam::{account_id}:role/{role_name}'), None)
+
+  def get_stats(self) -> dict:
+    with self.__lock:
+      return dict(self.__stats, size=len(self.__entries))
+
+ROLE_CREDENTIALS = RoleCredentialCache()
+
+def get_role_credentials(account_id: str, role_name: str, external_id: str) -> RoleCredentials:
+  return ROLE_CREDENTIALS.get(account_id, role_name, external_id)
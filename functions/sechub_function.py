@@ -1,78 +1,408 @@
 import os
 import json
-import boto3
+import math
+import time
 import requests
+from collections import OrderedDict
 from botocore.exceptions import ClientError
+from aws_clients import RoleClientPool, get_client
+from batch_outcomes import BatchOutcomes
+from logger import get_logger, log_payload
+from latency import get_message_attribute, get_pipeline_lag, now_ms
+from metrics import Metrics
+from rate_governor import DeferredException, RateGovernor
+from role_credentials import ROLE_CREDENTIALS, get_role_credentials
+from ssm_params import get_parameter_cache
 
-def get_param(ssm_client, param_name, encrypted):
-  print("in get_param function")
-  response = ssm_client.get_parameter(
-    Name=param_name,
-    WithDecryption=encrypted
-  )
-  print("after response")
-  return response['Parameter']['Value']
+# BatchImportFindings limits: 100 findings and 6 MB per request. The byte
+# limit keeps some headroom for the request envelope.
+SECHUB_IMPORT_MAX_FINDINGS = 100
+SECHUB_IMPORT_MAX_BYTES = 6 * 1024 * 1024 - 4096
+# BatchUpdateFindings limit on FindingIdentifiers per request
+SECHUB_UPDATE_MAX_FINDINGS = 100
+# BatchUpdateFindings error codes for a finding Security Hub does not have.
+# There is nothing to resolve, so the record is done rather than retried.
+FINDING_NOT_FOUND_ERROR_CODES = {'FindingNotFound', 'FindingNotFoundException', 'ResourceNotFoundException'}
+# Seconds of invocation time kept back for deferring unsent records to SQS
+SECHUB_DEFER_MARGIN = float(os.environ.get('SECHUB_DEFER_MARGIN', '10'))
+# Longest delay for a deferred record; SQS allows up to 900 seconds
+SECHUB_DEFER_MAX = int(os.environ.get('SECHUB_DEFER_MAX', '300'))
+# Times a record is requeued as a new message before further deferrals only
+# change its visibility, which counts towards the findings DLQ
+SECHUB_MAX_DEFERRALS = int(os.environ.get('SECHUB_MAX_DEFERRALS', '5'))
+# SendMessageBatch and ChangeMessageVisibilityBatch limits
+SQS_BATCH_MAX_ENTRIES = 10
+SQS_BATCH_MAX_BYTES = 262144
+
+logger = get_logger("sechub")
+# Security Hub clients per target account, kept across warm invocations
+SECHUB_CLIENTS = RoleClientPool('securityhub')
+# Client-side Security Hub rate limit per target account, region and API
+SECHUB_GOVERNOR = RateGovernor()
+
+def get_finding_region(asff_message, default_region):
+  # Findings must be imported in the region of their ProductArn
+  # (arn:aws:securityhub:<region>:<account>:product/...)
+  parts = asff_message.get('ProductArn', '').split(':')
+  return parts[3] if len(parts) > 3 and parts[3] else default_region
+
+def get_credentials(params, account_id):
+  try:
+    return get_role_credentials(account_id, params.get('role/name'), params.get('role/externalid'))
+  except ClientError as e:
+    if e.response['Error']['Code'] != 'AccessDenied':
+      raise
+    logger.warning("AssumeRole denied, reloading SSM params and retrying")
+    params.refresh()
+    return get_role_credentials(account_id, params.get('role/name'), params.get('role/externalid'))
+
+def chunk_findings(entries):
+  chunk = []
+  chunk_size = 0
+  for entry in entries:
+    size = entry["latest"]["size"]
+    if chunk and (len(chunk) == SECHUB_IMPORT_MAX_FINDINGS or chunk_size + size > SECHUB_IMPORT_MAX_BYTES):
+      yield chunk
+      chunk = []
+      chunk_size = 0
+    chunk.append(entry)
+    chunk_size += size
+  if chunk:
+    yield chunk
+
+def get_queue_url(queue_arn):
+  # arn:aws:sqs:<region>:<account>:<name>
+  _, partition, _, region, account_id, name = queue_arn.split(':')
+  domain = "amazonaws.com.cn" if partition == "aws-cn" else "amazonaws.com"
+  return region, f"https://sqs.{region}.{domain}/{account_id}/{name}"
+
+def get_deferrals(event_record):
+  deferrals = get_message_attribute(event_record, 'deferrals')
+  return int(deferrals) if deferrals and deferrals.isdigit() else 0
+
+def build_requeue_entry(index, event_record, delay):
+  """
+  SendMessageBatch entry carrying a Lambda SQS record's body and attributes,
+  with its deferral count increased. The time the record was first queued
+  is kept in queued_timestamp, as the new message gets its own SentTimestamp.
+  """
+  attributes = {}
+  for name, attribute in event_record.get('messageAttributes', {}).items():
+    if 'stringValue' in attribute:
+      attributes[name] = {'StringValue': attribute['stringValue'], 'DataType': attribute['dataType']}
+  attributes['deferrals'] = {'DataType': 'Number', 'StringValue': str(get_deferrals(event_record) + 1)}
+  sent = event_record.get('attributes', {}).get('SentTimestamp')
+  if 'queued_timestamp' not in attributes and sent:
+    attributes['queued_timestamp'] = {'DataType': 'Number', 'StringValue': str(sent)}
+  return {
+    'Id': str(index),
+    'MessageBody': event_record['body'],
+    'DelaySeconds': delay,
+    'MessageAttributes': attributes
+  }
+
+def get_requeue_entry_size(entry):
+  size = len(entry['MessageBody'].encode('utf-8'))
+  for name, attribute in entry.get('MessageAttributes', {}).items():
+    size += len(name.encode('utf-8')) + len(attribute['DataType'].encode('utf-8'))
+    size += len(attribute['StringValue'].encode('utf-8'))
+  return size
+
+def chunk_requeue_entries(entries):
+  chunk = []
+  chunk_size = 0
+  for entry in entries:
+    entry_size = get_requeue_entry_size(entry)
+    if chunk and (len(chunk) == SQS_BATCH_MAX_ENTRIES or chunk_size + entry_size > SQS_BATCH_MAX_BYTES):
+      yield chunk
+      chunk = []
+      chunk_size = 0
+    chunk.append(entry)
+    chunk_size += entry_size
+  if chunk:
+    yield chunk
+
+def requeue_records(sqs_client, queue_url, records, delay):
+  """
+  Send copies of records back to their queue with SendMessageBatch, delayed
+  by delay seconds. Returns the records that could not be sent.
+  """
+  entries = [build_requeue_entry(index, record["event_record"], delay) for index, record in enumerate(records)]
+  unsent = []
+  for chunk in chunk_requeue_entries(entries):
+    try:
+      response = sqs_client.send_message_batch(QueueUrl=queue_url, Entries=chunk)
+    except ClientError as e:
+      logger.warning("Could not requeue %d records to %s: %s", len(chunk), queue_url, e)
+      unsent.extend(records[int(entry['Id'])] for entry in chunk)
+      continue
+    for failure in response.get('Failed', []):
+      record = records[int(failure['Id'])]
+      logger.warning("Requeue of %s failed: %s %s", record["message_id"], failure.get('Code'), failure.get('Message'))
+      unsent.append(record)
+  return unsent
+
+def delay_records(sqs_client, queue_url, records, delay):
+  """Set the visibility timeout of records to delay seconds with ChangeMessageVisibilityBatch."""
+  for index in range(0, len(records), SQS_BATCH_MAX_ENTRIES):
+    chunk = records[index:index + SQS_BATCH_MAX_ENTRIES]
+    try:
+      response = sqs_client.change_message_visibility_batch(QueueUrl=queue_url, Entries=[
+        {
+          'Id': str(position),
+          'ReceiptHandle': record["event_record"]['receiptHandle'],
+          'VisibilityTimeout': delay
+        } for position, record in enumerate(chunk)
+      ])
+    except ClientError as e:
+      # Still redelivered, only after the queue's own visibility timeout
+      logger.warning("Could not change visibility of %d records: %s", len(chunk), e)
+      continue
+    for failure in response.get('Failed', []):
+      logger.warning("Could not change visibility of %s: %s %s", chunk[int(failure['Id'])]["message_id"], failure.get('Code'), failure.get('Message'))
+
+def defer_records(records, delay, outcomes, metrics):
+  """
+  Hand records back to SQS for another attempt in delay seconds. Each record
+  is sent to its queue again as a new, delayed message and the original
+  counts as handled, so deferring neither uses up the original's receive
+  count towards the DLQ nor fails the batch. Records already requeued
+  SECHUB_MAX_DEFERRALS times, and records that cannot be sent again, have
+  their visibility timeout set to delay instead and are reported as batch
+  item failures, so a record deferred for good still reaches the DLQ.
+  """
+  delay = min(SECHUB_DEFER_MAX, 900, max(0, int(delay)))
+  queues = OrderedDict()
+  for record in records:
+    queues.setdefault(record["event_record"].get('eventSourceARN'), []).append(record)
+  for queue_arn, queued in queues.items():
+    try:
+      region, queue_url = get_queue_url(queue_arn)
+      sqs_client = get_client('sqs', region_name=region)
+    except (AttributeError, ValueError) as e:
+      logger.warning("Cannot requeue records from %s: %s", queue_arn, e)
+      for record in queued:
+        outcomes.defer(record["message_id"], "Security Hub rate budget exhausted, retry after the visibility timeout")
+      continue
+    requeue = []
+    unsent = []
+    for record in queued:
+      if get_deferrals(record["event_record"]) < SECHUB_MAX_DEFERRALS:
+        requeue.append(record)
+      else:
+        logger.warning("Record %s deferred %d times, leaving it on the queue", record["message_id"], SECHUB_MAX_DEFERRALS)
+        unsent.append(record)
+    if requeue:
+      requeue_unsent = requeue_records(sqs_client, queue_url, requeue, delay)
+      metrics.count("RecordsRequeued", len(requeue) - len(requeue_unsent))
+      unsent.extend(requeue_unsent)
+    if unsent:
+      delay_records(sqs_client, queue_url, unsent, delay)
+    for record in unsent:
+      outcomes.defer(record["message_id"], f"Security Hub rate budget exhausted, retry in {delay}s")
+
+def record_delivered(finding, metrics):
+  lag = get_pipeline_lag(finding["event_record"], now_ms())
+  for hop, milliseconds in lag.items():
+    metrics.add_timing(hop, milliseconds)
+  logger.debug("Finding %s delivered", finding["asff"]['Id'], extra={"fields": {
+    "correlation_id": get_message_attribute(finding["event_record"], 'correlation_id'),
+    "lag": lag
+  }})
+
+def latest_by_id(findings):
+  """
+  Finding Id -> {"latest": the most recently updated record, "records": every
+  record for the Id}. Records with the same UpdatedAt go to the later one.
+  """
+  entries = OrderedDict()
+  for finding in findings:
+    entry = entries.setdefault(finding["asff"]['Id'], {"latest": finding, "records": []})
+    entry["records"].append(finding)
+    if finding["asff"].get('UpdatedAt', '') >= entry["latest"]["asff"].get('UpdatedAt', ''):
+      entry["latest"] = finding
+  return entries
+
+def import_findings(sechub_client, target, entries, outcomes, metrics, deadline=math.inf):
+  """
+  Import the latest version of each finding entry (see latest_by_id) with
+  BatchImportFindings, up to SECHUB_IMPORT_MAX_FINDINGS and
+  SECHUB_IMPORT_MAX_BYTES per call. Every record of an entry shares its
+  outcome; FailedFindings are mapped back to them. Calls go through
+  SECHUB_GOVERNOR for the (account, region) target; chunks it defers are
+  handed back to SQS.
+  """
+  for chunk in chunk_findings(entries):
+    logger.debug("Reporting %d findings", len(chunk))
+    start = time.perf_counter()
+    try:
+      response = SECHUB_GOVERNOR.call(target + ("BatchImportFindings",), lambda: sechub_client.batch_import_findings(
+        Findings=[entry["latest"]["asff"] for entry in chunk]
+      ), deadline)
+    except DeferredException as e:
+      defer_records([record for entry in chunk for record in entry["records"]], e.delay, outcomes, metrics)
+      continue
+    except ClientError as e:
+      for entry in chunk:
+        for record in entry["records"]:
+          outcomes.fail(record["message_id"], repr(e))
+      continue
+    finally:
+      metrics.add_timing("SecurityHubImport", (time.perf_counter() - start) * 1000)
+    log_payload(logger, "Findings sent", response)
+    metrics.count("FindingsImported", response.get('SuccessCount', 0))
+    failed = {}
+    for failure in response.get('FailedFindings', []):
+      failed[failure.get('Id')] = f"{failure.get('ErrorCode')}: {failure.get('ErrorMessage')}"
+    for entry in chunk:
+      finding_id = entry["latest"]["asff"]['Id']
+      for record in entry["records"]:
+        if finding_id in failed:
+          outcomes.fail(record["message_id"], f"Security Hub did not accept the finding: {failed[finding_id]}")
+        else:
+          record_delivered(record, metrics)
+
+def resolve_findings(sechub_client, target, entries, outcomes, metrics, deadline=math.inf):
+  """
+  Resolve finding entries (see latest_by_id) with BatchUpdateFindings.
+  Entries whose latest update payload (note text and types) is the same
+  share calls of up to SECHUB_UPDATE_MAX_FINDINGS identifiers.
+  UnprocessedFindings are mapped back to the records of the entry, except
+  findings Security Hub does not have, which count as handled. Rate limited
+  like import_findings.
+  """
+  payloads = OrderedDict()
+  for entry in entries:
+    latest = entry["latest"]
+    identifiers = payloads.setdefault(latest["update_key"], OrderedDict())
+    identifiers[(latest["asff"]['Id'], latest["asff"]['ProductArn'])] = entry
+
+  for (description, types), identifiers in payloads.items():
+    keys = list(identifiers.keys())
+    for index in range(0, len(keys), SECHUB_UPDATE_MAX_FINDINGS):
+      chunk = keys[index:index + SECHUB_UPDATE_MAX_FINDINGS]
+      logger.debug("Resolving %d findings", len(chunk))
+      start = time.perf_counter()
+      try:
+        response = SECHUB_GOVERNOR.call(target + ("BatchUpdateFindings",), lambda: sechub_client.batch_update_findings(
+          FindingIdentifiers=[
+            {
+              'Id': finding_id,
+              'ProductArn': product_arn
+            } for finding_id, product_arn in chunk
+          ],
+          Note={
+            'Text': description,
+            'UpdatedBy': 'string'
+          },
+          Severity={
+            'Product': 0,
+            'Label': 'INFORMATIONAL'
+          },
+          Confidence=100,
+          Types=list(types),
+          Workflow={
+              'Status': 'RESOLVED'
+          }
+        ), deadline)
+      except DeferredException as e:
+        defer_records([record for key in chunk for record in identifiers[key]["records"]], e.delay, outcomes, metrics)
+        continue
+      except ClientError as e:
+        for key in chunk:
+          for record in identifiers[key]["records"]:
+            outcomes.fail(record["message_id"], repr(e))
+        continue
+      finally:
+        metrics.add_timing("SecurityHubUpdate", (time.perf_counter() - start) * 1000)
+      log_payload(logger, "Findings sent", response)
+      metrics.count("FindingsResolved", len(response.get('ProcessedFindings', [])))
+      unprocessed = {}
+      for failure in response.get('UnprocessedFindings', []):
+        identifier = failure.get('FindingIdentifier', {})
+        key = (identifier.get('Id'), identifier.get('ProductArn'))
+        if failure.get('ErrorCode') in FINDING_NOT_FOUND_ERROR_CODES:
+          logger.info("Finding %s not in Security Hub, nothing to resolve", key[0])
+          metrics.count("FindingsNotFound")
+          continue
+        unprocessed[key] = f"{failure.get('ErrorCode')}: {failure.get('ErrorMessage')}"
+      for key in chunk:
+        for record in identifiers[key]["records"]:
+          if key in unprocessed:
+            outcomes.fail(record["message_id"], f"Security Hub did not update the finding: {unprocessed[key]}")
+          else:
+            record_delivered(record, metrics)
 
 def lambda_handler(event, context):
-  print("Parse Lambda Params")
+  metrics = Metrics("sechub")
+  deadline = math.inf
+  if context is not None:
+    deadline = time.monotonic() + context.get_remaining_time_in_millis() / 1000 - SECHUB_DEFER_MARGIN
+  try:
+    return process_batch(event, metrics, deadline)
+  finally:
+    metrics.flush()
+
+def process_batch(event, metrics, deadline=math.inf):
+  logger.debug("Parse Lambda Params")
   AWS_REGION = os.environ['AWS_REGION']
   SSM_PREFIX = "/sechub/integration"
-  print("Parse SSM Params")
-  print("ssm_client")
-  ssm_client = boto3.client('ssm')
-  role_name = get_param(ssm_client, f'{SSM_PREFIX}/siemens/role/name', False)
-  role_ext_id = get_param(ssm_client, f'{SSM_PREFIX}/siemens/role/externalid', True)
+  logger.debug("Parse SSM Params")
+  with metrics.timer("SsmLoad"):
+    params = get_parameter_cache(f'{SSM_PREFIX}/siemens/')
+    params.get_all()
 
-  print("Iterate over events")
+  logger.info("Processing %d records", len(event['Records']))
+  outcomes = BatchOutcomes(event['Records'], metrics)
+  # (account, region) -> findings to import or resolve there
+  groups = OrderedDict()
   for event_record in event['Records']:
     #receipt_handle = event_record['receiptHandle']
-    asff_message = json.loads(event_record['body'])
-    print("Parsed ASFF:")
-    account_id = asff_message['AwsAccountId']
-    sts_client = boto3.client('sts')
-    print(f"Get Assume role creds for: {role_name}")
-    sts_creds = sts_client.assume_role(
-      RoleArn=f'arn:aws:iam::{account_id}:role/{role_name}',
-      ExternalId=role_ext_id,
-      RoleSessionName='TurbotSecurityHubReporting'
-    )
-    print(f"Assuming secuirty hub reporting role in target account")
-    sechub_report_client = boto3.client(
-      'securityhub', 
-      aws_access_key_id=sts_creds['Credentials']['AccessKeyId'],
-      aws_secret_access_key=sts_creds['Credentials']['SecretAccessKey'], 
-      aws_session_token=sts_creds['Credentials']['SessionToken'],
-      region_name=AWS_REGION
-    )
-    print(asff_message)
-    print("Parsing Finding")
-    if asff_message['Title'].split(":")[0].lower() == "ok":
-      print(f"Update finding")
-      response = sechub_report_client.batch_update_findings(
-        FindingIdentifiers=[
-          {
-            'Id': asff_message['Id'],
-            'ProductArn': asff_message['ProductArn']
-          },
-        ],
-        Note={
-          'Text': asff_message['Description'],
-          'UpdatedBy': 'string'
-        },
-        Severity={
-          'Product': 0,
-          'Label': 'INFORMATIONAL'
-        },
-        Confidence=100,
-        Types=asff_message['Types'],
-        Workflow={
-            'Status': 'RESOLVED'
-        }
-    )
-    else:
-      print(f"Reporting finding")
-      response = sechub_report_client.batch_import_findings(
-        Findings=[asff_message]
-      )
-    print("Findings sent, response:")
-    print(response)
\ No newline at end of file
+    message_id = event_record['messageId']
+    try:
+      asff_message = json.loads(event_record['body'])
+      key = (asff_message['AwsAccountId'], get_finding_region(asff_message, AWS_REGION))
+      resolve = asff_message['Title'].split(":")[0].lower() == "ok"
+      # Resolutions with the same note text and types share an update call
+      update_key = (asff_message['Description'], tuple(asff_message['Types'])) if resolve else None
+    except (ValueError, KeyError, TypeError, AttributeError) as e:
+      outcomes.fail(message_id, repr(e))
+      continue
+    log_payload(logger, "Parsed ASFF", asff_message)
+    groups.setdefault(key, []).append({
+      "message_id": message_id,
+      "event_record": event_record,
+      "asff": asff_message,
+      "resolve": resolve,
+      "update_key": update_key,
+      # Body size plus the separator in the Findings array
+      "size": len(event_record['body'].encode('utf-8')) + 1
+    })
+
+  for (account_id, region), findings in groups.items():
+    logger.debug("Sending %d findings to %s in %s", len(findings), account_id, region)
+    try:
+      with metrics.timer("StsAssume"):
+        sts_creds = get_credentials(params, account_id)
+      sechub_report_client = SECHUB_CLIENTS.get_client(sts_creds, region)
+    except (ClientError, KeyError) as e:
+      for finding in findings:
+        outcomes.fail(finding["message_id"], repr(e))
+      continue
+    target = (account_id, region)
+    # Only the latest action per finding Id is sent; older imports or
+    # resolutions of the same finding share its outcome
+    entries = latest_by_id(findings).values()
+    imports = [entry for entry in entries if not entry["latest"]["resolve"]]
+    resolutions = [entry for entry in entries if entry["latest"]["resolve"]]
+    if imports:
+      import_findings(sechub_report_client, target, imports, outcomes, metrics, deadline)
+    if resolutions:
+      resolve_findings(sechub_report_client, target, resolutions, outcomes, metrics, deadline)
+
+  logger.info("Role credential and client caches", extra={"fields": {
+    "credentials": ROLE_CREDENTIALS.get_stats(),
+    "clients": SECHUB_CLIENTS.get_stats(),
+    "governor": SECHUB_GOVERNOR.get_stats()
+  }})
+  return outcomes.get_response()
@@ -0,0 +1,104 @@
+import os
+import time
+import threading
+from aws_clients import get_client
+from logger import get_logger
+
+# Seconds a fetched parameter set is served before it is reloaded from SSM
+SSM_PARAM_TTL = float(os.environ.get('SSM_PARAM_TTL', '300'))
+# Fraction of the TTL after which a background refresh is started
+SSM_PARAM_REFRESH_AHEAD = float(os.environ.get('SSM_PARAM_REFRESH_AHEAD', '0.8'))
+
+logger = get_logger("ssm")
+
+class ParameterCache:
+  """
+  Container wide cache of every SSM parameter below a path.
+
+  The whole path is loaded with get_parameters_by_path (decrypted) in one go
+  and kept across warm invocations. Once the cache is older than the
+  refresh-ahead mark a background reload is started; once it is older than
+  the TTL the caller reloads synchronously. refresh() can be called directly
+  when an auth failure suggests the stored keys were rotated.
+  """
+  def __init__(self, path: str, ttl: float = SSM_PARAM_TTL, ssm_client=None) -> None:
+    if not path or type(path) is not str:
+      raise ValueError("path is missing or not string type")
+
+    self.__path = path if path.endswith("/") else f"{path}/"
+    self.__ttl = ttl
+    self.__ssm_client = ssm_client
+    self.__values = None
+    self.__loaded_at = 0.0
+    self.__lock = threading.Lock()
+    self.__refreshing = False
+
+  def get_path(self) -> str:
+    return self.__path
+
+  def __get_ssm_client(self):
+    if self.__ssm_client is None:
+      self.__ssm_client = get_client('ssm')
+    return self.__ssm_client
+
+  def __load(self) -> dict:
+    logger.info("Loading SSM parameters under %s", self.__path)
+    values = {}
+    paginator = self.__get_ssm_client().get_paginator('get_parameters_by_path')
+    for page in paginator.paginate(Path=self.__path, Recursive=True, WithDecryption=True):
+      for param in page['Parameters']:
+        values[param['Name'][len(self.__path):]] = param['Value']
+    return values
+
+  def refresh(self) -> dict:
+    values = self.__load()
+    with self.__lock:
+      self.__values = values
+      self.__loaded_at = time.monotonic()
+      self.__refreshing = False
+    return values
+
+  def __background_refresh(self) -> None:
+    try:
+      self.refresh()
+    except Exception as e:
+      logger.warning("Background SSM refresh failed: %s", e)
+      with self.__lock:
+        self.__refreshing = False
+
+  def get_all(self) -> dict:
+    with self.__lock:
+      values = self.__values
+      age = time.monotonic() - self.__loaded_at
+      start_refresh = (
+        values is not None
+        and self.__ttl * SSM_PARAM_REFRESH_AHEAD < age <= self.__ttl
+        and not self.__refreshing
+      )
+      if start_refresh:
+        self.__refreshing = True
+    if values is None or age > self.__ttl:
+      return self.refresh()
+    if start_refresh:
+      threading.Thread(target=self.__background_refresh, daemon=True).start()
+    return values
+
+  def get(self, name: str) -> str:
+    values = self.get_all()
+    if name not in values:
+      raise KeyError(f"SSM parameter not found: {self.__path}{name}")
+    return values[name]
+
+  def invalidate(self) -> None:
+    with self.__lock:
+      self.__values = None
+      self.__loaded_at = 0.0
+
+_caches = {}
+_caches_lock = threading.Lock()
+
+def get_parameter_cache(path: str) -> ParameterCache:
+  with _caches_lock:
+    if path not in _caches:
+      _caches[path] = ParameterCache(path)
+    return _caches[path]
@@ -0,0 +1,61 @@
+import json
+import random
+import string
+import unittest
+from asff import FindingFactory
+from control_event import AwsLocation, ControlEvent, ControlSnapshot
+
+# Printable ASCII plus characters json.dumps escapes: quotes, backslashes,
+# control characters, non-ASCII, astral plane
+ALPHABET = string.printable + 'éü中文퟿"\\\x00\x1f\U0001f642'
+CASES = 5000
+
+def random_text(rng: random.Random) -> str:
+  return ''.join(rng.choice(ALPHABET) for _ in range(rng.randint(0, 20)))
+
+def random_pair(rng: random.Random):
+  event = ControlEvent("message", "control_updated")
+  event.control_id = random_text(rng)
+  event.state = rng.choice(["alarm", "ok"])
+  event.create_timestamp = random_text(rng)
+  event.reason = rng.choice([None, "", random_text(rng)])
+  event.control_type_title = random_text(rng)
+  event.aws = AwsLocation(
+    random_text(rng),
+    rng.choice([None, random_text(rng)]),
+    rng.choice([None, random_text(rng)])
+  )
+  snapshot = ControlSnapshot(event.state, [random_text(rng) for _ in range(rng.randint(0, 4))])
+  return event, snapshot
+
+class SerializeMatchesBuildTest(unittest.TestCase):
+  """FindingFactory.serialize must produce exactly json.dumps(build(...))."""
+
+  def setUp(self) -> None:
+    self.factory = FindingFactory("us-east-1")
+
+  def test_random_findings(self):
+    rng = random.Random(20220530)
+    for case in range(CASES):
+      event, snapshot = random_pair(rng)
+      with self.subTest(case=case):
+        self.assertEqual(self.factory.serialize(event, snapshot), json.dumps(self.factory.build(event, snapshot)))
+
+  def test_non_string_fields_fall_back(self):
+    rng = random.Random(1)
+    for case in range(100):
+      event, snapshot = random_pair(rng)
+      event.aws.account_id = rng.randint(0, 10 ** 12)
+      with self.subTest(case=case):
+        self.assertEqual(self.factory.serialize(event, snapshot), json.dumps(self.factory.build(event, snapshot)))
+
+  def test_many_matches_single(self):
+    rng = random.Random(2)
+    pairs = [random_pair(rng) for _ in range(50)]
+    self.assertEqual(
+      self.factory.serialize_many(pairs),
+      [json.dumps(finding) for finding in self.factory.build_many(pairs)]
+    )
+
+if __name__ == "__main__":
+  unittest.main()
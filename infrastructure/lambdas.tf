@@ -89,6 +89,8 @@ resource "aws_lambda_function" "lambda_filter_functions" {
     variables = {
       WORKSPACE_NAME = each.key
       FINDINGS_QUEUE_URL = aws_sqs_queue.findings_queue.url
+      REPORT_BATCH_ITEM_FAILURES = var.report_batch_item_failures
+      LOG_LEVEL = var.log_level
     }
   }
 }
@@ -98,6 +100,13 @@ resource "aws_lambda_event_source_mapping" "filter_function_to_sqs" {
   event_source_arn = aws_sqs_queue.raw_alarms_queue[each.key].arn
   function_name    = aws_lambda_function.lambda_filter_functions[each.key].arn
   batch_size       = 10
+  function_response_types = var.report_batch_item_failures ? ["ReportBatchItemFailures"] : []
+}
+
+# A Security Hub batch of more than one record always reports item failures,
+# so one failed or deferred finding does not redeliver the whole batch
+locals {
+  sechub_report_batch_item_failures = var.report_batch_item_failures || var.sechub_batch_size > 1
 }
 
 resource "aws_lambda_function" "lambda_sechub_function" {
@@ -107,10 +116,11 @@ resource "aws_lambda_function" "lambda_sechub_function" {
   filename         = "lambdas.zip"
   function_name    = "sechub_integration_sechub_function"
   source_code_hash = filebase64sha256("lambdas.zip")
-  timeout          = 30
+  timeout          = 120
   environment {
     variables = {
-      foo = "bar"
+      REPORT_BATCH_ITEM_FAILURES = local.sechub_report_batch_item_failures
+      LOG_LEVEL = var.log_level
     }
   }
 }
@@ -119,5 +129,7 @@ resource "aws_lambda_event_source_mapping" "sechub_function_to_sqs" {
   for_each         = var.workspaces
   event_source_arn = aws_sqs_queue.findings_queue.arn
   function_name    = aws_lambda_function.lambda_sechub_function.arn
-  batch_size       = 1
+  batch_size       = var.sechub_batch_size
+  maximum_batching_window_in_seconds = var.sechub_batching_window
+  function_response_types = local.sechub_report_batch_item_failures ? ["ReportBatchItemFailures"] : []
 }
\ No newline at end of file
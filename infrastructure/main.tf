@@ -45,4 +45,28 @@ variable "assume_role_name" {
 variable "assume_role_external_id" {
   description = "Enter external id cross account role for sending security hub issues"
   type        = string
-}
\ No newline at end of file
+}
+
+variable "report_batch_item_failures" {
+  description = "Only redeliver the failed records of an SQS batch instead of the whole batch; always on for the Security Hub function when sechub_batch_size is above 1"
+  type        = bool
+  default     = false
+}
+
+variable "log_level" {
+  description = "Log level of the Lambda functions (DEBUG, INFO, WARNING, ERROR)"
+  type        = string
+  default     = "INFO"
+}
+
+variable "sechub_batch_size" {
+  description = "Maximum findings queue records per Security Hub function invocation (1-10000)"
+  type        = number
+  default     = 100
+}
+
+variable "sechub_batching_window" {
+  description = "Seconds to gather findings queue records before invoking the Security Hub function (required above 10 records)"
+  type        = number
+  default     = 5
+}
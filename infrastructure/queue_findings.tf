@@ -4,7 +4,7 @@ resource "aws_sqs_queue" "findings_queue" {
   sqs_managed_sse_enabled    = true
   delay_seconds              = 0
   receive_wait_time_seconds  = 10
-  visibility_timeout_seconds = 30
+  visibility_timeout_seconds = 150
   redrive_policy = jsonencode({
     deadLetterTargetArn = aws_sqs_queue.findings_dlq.arn
     maxReceiveCount     = 4
@@ -1,7 +1,14 @@
+import os
+import sys
 import json
-import boto3
 import requests
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "functions"))
+from aws_clients import get_client
+from logger import get_logger, log_payload
+
+logger = get_logger("watches")
+
 def get_param(ssm_client, param_name, encrypted):
   response = ssm_client.get_parameter(
     Name=param_name,
@@ -47,11 +54,11 @@ class GraphQl:
     )
 
     if response.status_code != 200 or response.json().get("errors"):
-      print("GraphQL query failed, throwing exception")
+      logger.error("GraphQL query failed, throwing exception")
       raise GraphQlException(f"Query failed: {response.text}")
 
     response = response.json()
-    print(f"Query result: {response}")
+    log_payload(logger, "Query result", response)
 
     return response
 
@@ -92,7 +99,7 @@ if __name__ == "__main__":
 
   for workspace_name, accounts in workspace_accounts.items():
     workspace = {}
-    ssm_client = boto3.client('ssm', region_name=AWS_REGION)
+    ssm_client = get_client('ssm', region_name=AWS_REGION)
     workspace_url = get_param(ssm_client, f'{SSM_PREFIX}{workspace_name}/workspace/url', False)
     workspace["endpoint"] = "{}/api/v5/graphql".format(workspace_url)
     if workspace_url[-1] == '/':
@@ -102,9 +109,9 @@ if __name__ == "__main__":
     gql = GraphQl(workspace)
 
     for account in accounts:
-      print(f"Creating watches for account: {account}")
+      logger.info("Creating watches for account: %s", account)
       for aka, filter in filters.items():
-        print(f"Creating {aka} watch")
+        logger.info("Creating %s watch", aka)
         vars = {
           "input": {
             "resource": account,
@@ -114,5 +121,4 @@ if __name__ == "__main__":
           }
         }
         response = gql.run_query(mutation, vars)
-        print(response)
-        print()
+        logger.info("Created %s watch", aka, extra={"fields": {"response": response}})